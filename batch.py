@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from data_processing import load_excel
+from main import main_script
+from testreport import extract_date_from_filename
+
+# Основная база, загруженная один раз на процесс-исполнитель
+_worker_input_df = None
+
+
+def collect_jobs(report_dir, output_dir):
+    """
+    Собирает задания по каталогу отчетов: каждый .xlsx файл с датой в имени дает пару (отчет, выходной файл).
+    Задания упорядочены по дате отчета. Имя выходного файла строится из имени отчета, поэтому
+    шаблоны с одной датой не перезаписывают результаты друг друга.
+    """
+    jobs = []
+    for name in os.listdir(report_dir):
+        if not name.lower().endswith('.xlsx') or name.startswith('~$'):
+            continue
+        date = extract_date_from_filename(name)
+        if not date:
+            continue
+        day, month, year = date.split('.')
+        output_file = os.path.join(output_dir, f"processed_data {name}")
+        jobs.append(((year, month, day), os.path.join(report_dir, name), output_file))
+    return [(report_file, output_file) for _, report_file, output_file in sorted(jobs)]
+
+
+def _init_worker(input_df):
+    global _worker_input_df
+    _worker_input_df = input_df
+
+
+def _run_job(input_file, sheet_name, report_file, report_sheet, output_file, cache_dir):
+    start = time.perf_counter()
+    try:
+        ok = main_script(input_file, sheet_name, report_file, report_sheet, output_file, cache_dir,
+                         input_df=_worker_input_df)
+        error = None if ok else "main_script reported a failure, see the log"
+    except Exception as e:
+        ok, error = False, str(e)
+    return {'report_file': report_file, 'output_file': output_file, 'ok': bool(ok), 'error': error,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def run_batch(input_file, sheet_name, jobs, report_sheet, workers=None, cache_dir=None, header_row=0):
+    """
+    Строит несколько отчетов по одной основной базе в пуле процессов.
+    jobs - список пар (файл отчета, выходной файл). База загружается один раз и передается
+    каждому процессу при его запуске, а не с каждым заданием.
+    Возвращает DataFrame с результатом каждого задания в порядке jobs.
+    """
+    input_df = load_excel(input_file, sheet_name, header_row, cache_dir=cache_dir)
+    if input_df is None:
+        return pd.DataFrame([{'report_file': report_file, 'output_file': output_file, 'ok': False,
+                              'error': f"Could not load {input_file}", 'seconds': 0.0}
+                             for report_file, output_file in jobs])
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(input_df,)) as pool:
+        futures = [pool.submit(_run_job, input_file, sheet_name, report_file, report_sheet, output_file, cache_dir)
+                   for report_file, output_file in jobs]
+        results = []
+        for (report_file, output_file), future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # Падение процесса-исполнителя не должно скрывать результаты остальных заданий
+                results.append({'report_file': report_file, 'output_file': output_file, 'ok': False,
+                                'error': str(e), 'seconds': 0.0})
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    # Разбор параметров общий с cli.py: python batch.py ... равносильно python cli.py batch ...
+    from cli import main as cli_main
+
+    sys.exit(cli_main(['batch', *sys.argv[1:]]))
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import openpyxl
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+
+from cache import cache_invalidate
+from data_processing import (bezzalogovye, column_order, create_dataframes_by_division, find_ordered_types_in_report,
+                             load_excel, process_dataframes, reorder_dataframe, zalogovye)
+from main import write_blocks
+from report_session import ReportSession
+from testreport import create_od_percent_table
+
+# Блоки отчета (объединенные заголовки) и одноименные деления основной базы
+buckets = ['30-', '30+', '60+', '90+', '180+', '365+']
+report_sheet = 'Сводная погашения NEW'
+report_date = '21.06.2024'
+
+# Размеры генерируемых данных для каждого масштаба
+scales = {
+    'small': {'rows': 10_000, 'divisions': 10, 'credit_types': 10, 'results': 12, 'template_rows': 500},
+    'medium': {'rows': 100_000, 'divisions': 50, 'credit_types': 20, 'results': 16, 'template_rows': 2_000},
+    'large': {'rows': 1_000_000, 'divisions': 300, 'credit_types': 25, 'results': 16, 'template_rows': 5_000},
+}
+
+# Модули, время импорта которых замеряется в отдельном процессе интерпретатора
+startup_modules = ['cli', 'testreport', 'data_processing', 'main']
+
+# Допустимое замедление относительно базовой линии и минимальная абсолютная разница (сек)
+default_tolerance = 0.2
+min_regression_seconds = 0.05
+
+
+def make_credit_types(count):
+    """
+    Возвращает count типов кредита: сначала известные залоговые и беззалоговые, затем неизвестные.
+    """
+    known = zalogovye + bezzalogovye
+    return known[:count] + [f'Прочий тип {i}' for i in range(max(0, count - len(known)))]
+
+
+def make_divisions(count):
+    return buckets[:count] + [f'Деление {i}' for i in range(max(0, count - len(buckets)))]
+
+
+def make_results(count):
+    # Последнее значение не входит в column_order и отбрасывается при построении таблиц
+    known = column_order[:-1]
+    return known[:count] + [f'Прочий результат {i}' for i in range(max(0, count - len(known)))]
+
+
+def generate_base(file_path, rows, divisions, credit_types, results, seed=0, missing_share=0.02, extra_columns=3):
+    """
+    Создает основную базу Excel со столбцами "ТИП кредита", "Результат", "Деления" и лишними столбцами.
+    Доля missing_share значений типа и результата оставляется пустой.
+    """
+    rng = np.random.default_rng(seed)
+    types = np.array(make_credit_types(credit_types), dtype=object)
+    result_values = np.array(make_results(results), dtype=object)
+    division_values = np.array(make_divisions(divisions), dtype=object)
+
+    type_column = types[rng.integers(0, len(types), rows)]
+    result_column = result_values[rng.integers(0, len(result_values), rows)]
+    division_column = division_values[rng.integers(0, len(division_values), rows)]
+    type_column[rng.random(rows) < missing_share] = None
+    result_column[rng.random(rows) < missing_share] = None
+    extra = rng.integers(0, 1_000_000, (rows, extra_columns))
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Лист1')
+    sheet.append(['Номер', 'ТИП кредита', 'Результат', 'Деления'] + [f'Поле {i}' for i in range(extra_columns)])
+    for i in range(rows):
+        sheet.append([i + 1, type_column[i], result_column[i], division_column[i]] + extra[i].tolist())
+    workbook.save(file_path)
+
+
+def generate_template(file_path, credit_types, date=report_date, block_width=6, extra_rows=0):
+    """
+    Создает шаблон отчета: строки с типами кредита и итогами, блоки buckets с объединенными заголовками,
+    заголовками "Просроченная задолженность", "% ОД к просроченному портфелю" и формулами сумм.
+    extra_rows - число строк детализации под итогами (размер листа, который обходит поиск разметки).
+    """
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = report_sheet
+    sheet['A1'] = 'Сводная погашения'
+    sheet['B3'] = f'Кол-во просроченных анкет на {date}'
+
+    labels = ['Итого'] + make_credit_types(credit_types) + ['Всего залоговые', 'Всего без залоговые',
+                                                            'Неопределенный']
+    first_row = 6
+    last_col = 8 + len(buckets) * (block_width + 2)
+    for i, label in enumerate(labels):
+        sheet.cell(first_row + i, 1, label)
+        for col in range(2, last_col):
+            sheet.cell(first_row + i, col, i * 10 + col)
+
+    fill_yellow = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    for k, bucket in enumerate(buckets):
+        col = 8 + k * (block_width + 2)
+        sheet.cell(2, col, bucket)
+        sheet.merge_cells(start_row=2, start_column=col, end_row=2, end_column=col + block_width - 1)
+        sheet.cell(3, col, f'Просроченная задолженность на {date}')
+        sheet.cell(4, col + 1, '% ОД к просроченному портфелю').fill = fill_yellow
+        total_row = first_row + len(labels) + 1
+        sheet.cell(total_row, col, f'=SUM({get_column_letter(col)}{first_row}:'
+                                   f'{get_column_letter(col + block_width - 1)}{total_row - 2})')
+    detail_row = first_row + len(labels) + 3
+    for i in range(extra_rows):
+        sheet.cell(detail_row + i, 1, f'Деталь {i}')
+        for col in range(2, last_col):
+            sheet.cell(detail_row + i, col, i + col)
+    sheet.column_dimensions['A'].width = 35
+    workbook.save(file_path)
+
+
+def prepare_inputs(work_dir, scale, params, seed=0):
+    """
+    Возвращает пути к базе и шаблону масштаба, создавая их только при отсутствии.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    suffix = f"{scale}_{params['rows']}_{params['divisions']}_{params['credit_types']}_{params['results']}_{seed}"
+    template_suffix = f"{suffix}_{params['template_rows']}"
+    input_file = os.path.join(work_dir, f"base_{suffix}.xlsx")
+    report_file = os.path.join(work_dir, f"Отчёт {template_suffix} {report_date}.xlsx")
+    if not os.path.isfile(input_file):
+        print(f"Generating {input_file}")
+        generate_base(input_file, params['rows'], params['divisions'], params['credit_types'], params['results'],
+                      seed)
+    if not os.path.isfile(report_file):
+        generate_template(report_file, params['credit_types'], extra_rows=params['template_rows'])
+    return input_file, report_file
+
+
+def timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return value
+
+
+def run_scale(work_dir, scale, params, repeat=3):
+    """
+    Прогоняет этапы конвейера repeat раз и возвращает медианное время каждого этапа (сек).
+    """
+    input_file, report_file = prepare_inputs(work_dir, scale, params)
+    output_file = os.path.join(work_dir, f"processed_{scale}.xlsx")
+    type_column, product_kind_column, result_column = 'ТИП кредита', 'Вид продукта', 'Результат'
+
+    timings = {}
+    for _ in range(repeat):
+        df = timed(timings, 'load_excel', load_excel, input_file, 'Лист1')
+        unique_types = df[type_column].dropna().unique().tolist()
+        ordered_types = find_ordered_types_in_report(report_file, report_sheet, unique_types)
+        df = reorder_dataframe(df, type_column, ordered_types)
+        dataframes = create_dataframes_by_division(df, 'Деления')
+        processed = timed(timings, 'process_dataframes', process_dataframes, dataframes, type_column,
+                          product_kind_column, result_column)
+
+        session = ReportSession(report_file, report_sheet)
+        addresses_df = timed(timings, 'create_od_percent_table', create_od_percent_table, report_file,
+                             report_sheet, buckets, workbook=session.workbook, cell_index=session.cell_index)
+        initial_headers_dict = {name: table.columns.tolist() for name, table in processed.items()}
+
+        def write_report():
+            write_blocks(session, processed, initial_headers_dict, addresses_df, report_sheet)
+            session.save(output_file)
+
+        timed(timings, 'write_report', write_report)
+        session.close()
+
+    timings.update(measure_layout_cache(report_file, os.path.join(work_dir, f"cache_{scale}"), repeat))
+    return {stage: round(statistics.median(values), 4) for stage, values in timings.items()}
+
+
+def measure_layout_cache(report_file, cache_dir, repeat=3):
+    """
+    Замеряет поиск адресов вставки в свежеоткрытом шаблоне без кэша (вместе с построением индекса значений)
+    и при попадании в кэш разметки. Возвращает списки времен этапов layout_discovery и layout_cache_hit.
+    """
+    timings = {}
+    cache_invalidate(cache_dir, namespace='layout')
+    for stage, stage_cache_dir in (('layout_discovery', None), ('layout_cache_hit', cache_dir)):
+        if stage_cache_dir:
+            with ReportSession(report_file, report_sheet) as session:
+                create_od_percent_table(report_file, report_sheet, buckets, cache_dir=stage_cache_dir, session=session)
+        for _ in range(repeat):
+            with ReportSession(report_file, report_sheet) as session:
+                timed(timings, stage, create_od_percent_table, report_file, report_sheet, buckets,
+                      cache_dir=stage_cache_dir, session=session)
+    return timings
+
+
+def check_layout_cache(results):
+    """
+    Возвращает масштабы, на которых попадание в кэш разметки не быстрее поиска без кэша.
+    """
+    return [scale for scale, stages in results.items()
+            if 'layout_cache_hit' in stages and stages['layout_cache_hit'] >= stages['layout_discovery']]
+
+
+def measure_import_times(modules=startup_modules, repeat=3):
+    """
+    Замеряет время импорта модулей в новом процессе (медиана за вычетом запуска пустого интерпретатора).
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=package_dir, check=True)
+        return time.perf_counter() - start
+
+    interpreter = statistics.median(run('pass') for _ in range(repeat))
+    return {f'import {module}': round(max(0.0, statistics.median(run(f'import {module}') for _ in range(repeat))
+                                          - interpreter), 4)
+            for module in modules}
+
+
+def compare_with_baseline(results, baseline, tolerance=default_tolerance):
+    """
+    Возвращает список регрессий: этапы, ставшие медленнее базовой линии больше чем на tolerance.
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, seconds in stages.items():
+            reference = baseline.get(scale, {}).get(stage)
+            if reference is None:
+                continue
+            if seconds > reference * (1 + tolerance) and seconds - reference > min_regression_seconds:
+                regressions.append({'scale': scale, 'stage': stage, 'baseline': reference, 'seconds': seconds})
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры этапов построения отчета на синтетических данных.")
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=sorted(scales))
+    parser.add_argument('--work-dir', default='benchmark_data',
+                        help="Каталог для сгенерированных баз и шаблонов")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help="Записать результаты как базовую линию")
+    parser.add_argument('--tolerance', type=float, default=default_tolerance)
+    args = parser.parse_args()
+
+    results = {'startup': measure_import_times(repeat=args.repeat)}
+    results.update({scale: run_scale(args.work_dir, scale, scales[scale], args.repeat) for scale in args.scales})
+    for scale, stages in results.items():
+        for stage, seconds in stages.items():
+            print(f"{scale:>8} {stage:<25} {seconds:>10.4f} s")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+    else:
+        regressions = compare_with_baseline(results, load_baseline(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['scale']} {regression['stage']}: "
+                  f"{regression['baseline']:.4f} s -> {regression['seconds']:.4f} s")
+        slow_cache = check_layout_cache(results)
+        for scale in slow_cache:
+            print(f"LAYOUT CACHE {scale}: hit {results[scale]['layout_cache_hit']:.4f} s is not faster than "
+                  f"discovery {results[scale]['layout_discovery']:.4f} s")
+        if regressions or slow_cache:
+            raise SystemExit(1)
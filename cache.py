@@ -0,0 +1,124 @@
+import hashlib
+import os
+import pickle
+
+# Ограничение общего размера каталога кэша по умолчанию (байт)
+default_max_cache_bytes = 512 * 1024 * 1024
+
+# Каталог кэша, используемый, если он не передан явно
+default_cache_dir = os.environ.get('REPORT_CACHE_DIR') or None
+
+
+def file_fingerprint(file_path, content_hash=False):
+    """
+    Возвращает отпечаток файла: путь, размер и время изменения или хэш содержимого.
+    """
+    stat = os.stat(file_path)
+    if content_hash:
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return os.path.abspath(file_path), stat.st_size, digest.hexdigest()
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def make_cache_key(namespace, *parts):
+    """
+    Строит имя записи кэша из пространства имен и хэша переданных частей ключа.
+    """
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return f"{namespace}-{digest}"
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+
+def cache_load(cache_dir, key):
+    """
+    Загружает объект из кэша. Возвращает None, если записи нет или она повреждена.
+    """
+    path = cache_path(cache_dir, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return None  # запись вытеснил другой процесс
+    except Exception as e:
+        print(f"Error reading cache entry {path}: {e}")
+        cache_invalidate(cache_dir, key)
+        return None
+    # Время изменения файла служит отметкой последнего использования для вытеснения
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass  # запись уже вытеснена другим процессом, прочитанное значение остается верным
+    return value
+
+
+def cache_store(cache_dir, key, value, max_bytes=default_max_cache_bytes):
+    """
+    Сохраняет объект в кэш и вытесняет давно не использованные записи сверх ограничения размера.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = cache_path(cache_dir, key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        cache_evict(cache_dir, max_bytes, keep=key)
+    except Exception as e:
+        print(f"Error writing cache entry {key} to {cache_dir}: {e}")
+
+
+def cache_evict(cache_dir, max_bytes=default_max_cache_bytes, keep=None):
+    """
+    Удаляет записи кэша в порядке давности использования, пока общий размер превышает max_bytes.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # запись уже удалил другой процесс
+        entries.append((stat.st_mtime, stat.st_size, name[:-len('.pkl')], path))
+
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, key, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cache_invalidate(cache_dir, key=None, namespace=None):
+    """
+    Удаляет одну запись кэша, все записи пространства имен или весь кэш.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    if key is not None:
+        names = [f"{key}.pkl"]
+    else:
+        prefix = f"{namespace}-" if namespace else ''
+        names = [name for name in os.listdir(cache_dir) if name.startswith(prefix) and name.endswith('.pkl')]
+    for name in names:
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import sys
+
+from report_constants import (default_report_sheet, default_sheet_name, division_column, main_merged_cells,
+                              product_kind_column, result_column, type_column)
+
+# Модули с pandas, numpy и openpyxl импортируются внутри команд: каждая команда загружает только то,
+# что ей нужно, а win32com импортируется лишь при вставке столбцов через Excel
+
+
+def run_aggregate(args):
+    """
+    Только подсчет таблиц по основной базе, без записи отчета.
+    """
+    from data_processing import main
+
+    processed_dataframes = main(args.input_file, args.sheet_name, division_column, type_column, product_kind_column,
+                                result_column, args.report_file, args.report_sheet, args.header_row,
+                                cache_dir=args.cache_dir, streaming=args.streaming, chunk_rows=args.chunk_rows,
+                                incremental=args.incremental, divisions=args.divisions, concurrent=args.concurrent)
+    if not processed_dataframes:
+        print("No data was processed.")
+        return 1
+
+    if args.output:
+        tables = {str(name): json.loads(df.to_json(orient='split', force_ascii=False))
+                  for name, df in processed_dataframes.items()}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(tables, f, ensure_ascii=False, indent=2)
+        print(f"Tables saved to {args.output}")
+    else:
+        for name, df in processed_dataframes.items():
+            print(f"\n{name}:\n{df}")
+    return 0
+
+
+def run_layout(args):
+    """
+    Только поиск адресов вставки блоков в шаблоне отчета (без pandas).
+    """
+    from testreport import find_insert_addresses
+
+    results = find_insert_addresses(args.report_file, args.report_sheet, main_merged_cells, cache_dir=args.cache_dir)
+    if not results:
+        print("No insert addresses found.")
+        return 1
+    order = {category: i for i, category in enumerate(['Общий итог'] + main_merged_cells)}
+    for result in sorted(results, key=lambda result: order.get(result['Category'], len(order))):
+        print(f"{result['Category']}\t{result['Address']}")
+    return 0
+
+
+def run_report(args):
+    """
+    Полное построение отчета.
+    """
+    from main import main_script
+
+    previous_dataframes = None
+    if args.previous_input:
+        from data_processing import main
+
+        # Таблицы предыдущей даты считаются по тому же отчету (порядок типов кредита) и кэшу
+        previous_dataframes = main(args.previous_input, args.sheet_name, division_column, type_column,
+                                   product_kind_column, result_column, args.report_file, args.report_sheet,
+                                   args.header_row, cache_dir=args.cache_dir, divisions=args.divisions)
+        if not previous_dataframes:
+            print(f"No data was processed from {args.previous_input}.")
+            return 1
+
+    ok = main_script(args.input_file, args.sheet_name, args.report_file, args.report_sheet, args.output_file,
+                     args.cache_dir, incremental=args.incremental, divisions=args.divisions,
+                     concurrent=args.concurrent, previous_dataframes=previous_dataframes)
+    return 0 if ok else 1
+
+
+def run_batch(args):
+    """
+    Пакетное построение отчетов по каталогу шаблонов.
+    """
+    from batch import collect_jobs, run_batch
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = run_batch(args.input_file, args.sheet_name, collect_jobs(args.report_dir, args.output_dir),
+                        args.report_sheet, args.workers, args.cache_dir)
+    print(summary.to_string(index=False))
+    return 0 if summary['ok'].all() else 1
+
+
+def run_worker(args):
+    """
+    Постоянно работающий обработчик заданий из каталога очереди.
+    """
+    from worker import ReportWorker
+
+    worker = ReportWorker(args.cache_dir, args.max_templates, args.max_inputs)
+    worker.serve_spool(args.spool_dir, args.poll_interval, args.once)
+    return 0
+
+
+def add_global_arguments(parser, with_defaults=True):
+    """
+    Общие параметры всех команд. У подкоманд они добавляются без значений по умолчанию, поэтому
+    их можно указать и до, и после имени команды, не затирая значение, заданное до нее.
+    """
+    def default(value):
+        return value if with_defaults else argparse.SUPPRESS
+
+    parser.add_argument('--cache-dir', default=default(None), help="Каталог кэша снимков базы и разметки шаблона")
+    parser.add_argument('--profile', action='store_true', default=default(False),
+                        help="Показать время и память по этапам")
+    parser.add_argument('--profile-memory', action='store_true', default=default(False),
+                        help="Дополнительно включить tracemalloc")
+    parser.add_argument('--profile-json', default=default(None), help="Сохранить показатели по этапам в JSON")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Построение сводного отчета по основной базе.")
+    add_global_arguments(parser)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_input_arguments(subparser):
+        subparser.add_argument('input_file', help="Файл с исходными данными (xlsx, csv, parquet, arrow/feather)")
+        subparser.add_argument('--sheet-name', default=default_sheet_name)
+        subparser.add_argument('--header-row', type=int, default=0)
+        subparser.add_argument('--incremental', action='store_true',
+                               help="Пересчитывать только изменившиеся деления (нужен --cache-dir)")
+        subparser.add_argument('--divisions', nargs='+', default=None, help="Строить таблицы только для этих делений")
+        subparser.add_argument('--concurrent', action='store_true',
+                               help="Загружать базу в отдельном процессе параллельно с разбором отчета")
+
+    aggregate = subparsers.add_parser('aggregate', help="Подсчитать таблицы по делениям без записи отчета")
+    add_input_arguments(aggregate)
+    aggregate.add_argument('report_file', help="Отчет, задающий порядок типов кредита")
+    aggregate.add_argument('--report-sheet', default=default_report_sheet)
+    aggregate.add_argument('--streaming', action='store_true', help="Читать лист построчно в режиме read_only")
+    aggregate.add_argument('--chunk-rows', type=int, default=None, help="Считать базу частями по N строк")
+    aggregate.add_argument('--output', default=None, help="Сохранить таблицы в JSON вместо вывода на экран")
+    aggregate.set_defaults(handler=run_aggregate)
+
+    layout = subparsers.add_parser('layout', help="Найти адреса вставки блоков в шаблоне отчета")
+    layout.add_argument('report_file')
+    layout.add_argument('--report-sheet', default=default_report_sheet)
+    layout.set_defaults(handler=run_layout)
+
+    report = subparsers.add_parser('report', help="Построить отчет полностью")
+    add_input_arguments(report)
+    report.add_argument('report_file')
+    report.add_argument('output_file')
+    report.add_argument('--report-sheet', default=default_report_sheet)
+    report.add_argument('--previous-input', default=None,
+                        help="База за предыдущую дату: рядом с блоками вставляются изменения к ней")
+    report.set_defaults(handler=run_report)
+
+    batch = subparsers.add_parser('batch', help="Построить отчеты по всем шаблонам каталога")
+    batch.add_argument('input_file', help="Файл с исходными данными")
+    batch.add_argument('report_dir', help="Каталог с отчетами, в именах которых есть дата (ДД.ММ.ГГГГ)")
+    batch.add_argument('output_dir', help="Каталог для выходных файлов")
+    batch.add_argument('--sheet-name', default=default_sheet_name)
+    batch.add_argument('--report-sheet', default=default_report_sheet)
+    batch.add_argument('--workers', type=int, default=None, help="Количество процессов (по умолчанию - число ядер)")
+    batch.set_defaults(handler=run_batch)
+
+    worker = subparsers.add_parser('worker', help="Обрабатывать задания из каталога очереди, держа шаблоны в памяти")
+    worker.add_argument('spool_dir', help="Каталог очереди с подкаталогами incoming, processing и done")
+    worker.add_argument('--max-templates', type=int, default=8)
+    worker.add_argument('--max-inputs', type=int, default=2)
+    worker.add_argument('--poll-interval', type=float, default=1.0)
+    worker.add_argument('--once', action='store_true', help="Обработать имеющиеся задания и завершиться")
+    worker.set_defaults(handler=run_worker)
+
+    for subparser in subparsers.choices.values():
+        add_global_arguments(subparser, with_defaults=False)
+    return parser
+
+
+def main(argv=None):
+    """
+    Точка входа командной строки; batch.py и worker.py вызывают ее со своей подкомандой.
+    """
+    args = build_parser().parse_args(argv)
+
+    import instrumentation
+
+    if args.profile or args.profile_memory or args.profile_json:
+        instrumentation.enable(memory=args.profile_memory)
+    code = args.handler(args)
+    if instrumentation.enabled:
+        print(instrumentation.summary_table())
+        if args.profile_json:
+            instrumentation.write_json(args.profile_json)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
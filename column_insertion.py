@@ -0,0 +1,193 @@
+import copy
+import re
+
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+# Часть ссылки на ячейку или столбец: $A$1, A1, $A, A
+reference_part_pattern = re.compile(r'^(\$?)([A-Z]{1,3})(\$?)(\d*)$')
+
+
+def shift_reference_part(part, idx, amount, allow_column_only):
+    """
+    Сдвигает столбец в части ссылки (A1, $B$2, C), если он находится не левее idx.
+    """
+    match = reference_part_pattern.match(part)
+    if not match:
+        return part
+    col_abs, letters, row_abs, row = match.groups()
+    if not row and not allow_column_only:
+        return part
+    col = column_index_from_string(letters)
+    if col >= idx:
+        col += amount
+    return f"{col_abs}{get_column_letter(col)}{row_abs}{row}"
+
+
+def shift_reference(reference, idx, amount, sheet_title, own_sheet):
+    """
+    Сдвигает ссылку вида A1, A1:B2, A:B или Лист!A1 при вставке столбцов перед idx на листе sheet_title.
+    Ссылки без имени листа сдвигаются только в формулах самого листа (own_sheet=True).
+    """
+    sheet, _, address = reference.rpartition('!')
+    if sheet:
+        name = sheet[1:-1].replace("''", "'") if sheet.startswith("'") else sheet
+        if name != sheet_title:
+            return reference
+    elif not own_sheet:
+        return reference
+
+    parts = address.split(':')
+    if len(parts) > 2:
+        return reference
+    shifted = [shift_reference_part(part, idx, amount, len(parts) == 2) for part in parts]
+    return f"{sheet}{'!' if sheet else ''}{':'.join(shifted)}"
+
+
+def shift_formula(formula, idx, amount, sheet_title, own_sheet=True):
+    """
+    Сдвигает ссылки формулы на столбцы листа sheet_title, находящиеся не левее idx.
+    """
+    # Формулы условного форматирования хранятся без знака "="
+    has_prefix = formula.startswith('=')
+    tokenizer = Tokenizer(formula if has_prefix else f"={formula}")
+    for token in tokenizer.items:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            token.value = shift_reference(token.value, idx, amount, sheet_title, own_sheet)
+    rendered = tokenizer.render()
+    return rendered if has_prefix else rendered[1:]
+
+
+def shift_cell_range(cell_range, idx, amount):
+    """
+    Возвращает диапазон после вставки столбцов: правее вставки он сдвигается, через вставку - расширяется.
+    """
+    cell_range = CellRange(cell_range.coord)
+    if cell_range.min_col >= idx:
+        cell_range.shift(col_shift=amount)
+    elif cell_range.max_col >= idx:
+        cell_range.expand(right=amount)
+    return cell_range
+
+
+def shift_multi_cell_range(multi_range, idx, amount):
+    return MultiCellRange([shift_cell_range(cell_range, idx, amount) for cell_range in multi_range.ranges])
+
+
+def insert_columns(ws, idx, amount=1):
+    """
+    Вставляет amount столбцов перед столбцом idx средствами openpyxl, как Columns.Insert в Excel:
+    сдвигает ячейки, объединенные диапазоны, ширины столбцов, формулы, условное форматирование,
+    проверку данных, гиперссылки, именованные диапазоны и область печати; новые столбцы получают
+    формат столбца слева. Диаграммы, изображения и сводные таблицы не сдвигаются.
+    """
+    if amount <= 0:
+        return
+
+    # Объединенные диапазоны пересоздаются после сдвига ячеек
+    merged_ranges = [shift_cell_range(merged, idx, amount) for merged in ws.merged_cells.ranges]
+    ws.merged_cells = MultiCellRange()
+
+    ws.insert_cols(idx, amount)
+
+    # Формат новых ячеек берется из столбца слева
+    if idx > 1:
+        left_cells = [cell for (row, col), cell in ws._cells.items() if col == idx - 1 and cell.has_style]
+        for left_cell in left_cells:
+            for col in range(idx, idx + amount):
+                ws.cell(row=left_cell.row, column=col)._style = copy.copy(left_cell._style)
+
+    for merged in merged_ranges:
+        ws.merge_cells(merged.coord)
+
+    shift_column_dimensions(ws, idx, amount)
+
+    # Формулы на всех листах книги, ссылающиеся на сдвинутые столбцы
+    for sheet in ws.parent.worksheets:
+        own_sheet = sheet is ws
+        for row in sheet.iter_rows():
+            for cell in row:
+                if cell.data_type == 'f' and isinstance(cell.value, str):
+                    cell.value = shift_formula(cell.value, idx, amount, ws.title, own_sheet)
+
+    conditional_formatting = ConditionalFormattingList()
+    for cf in ws.conditional_formatting:
+        sqref = shift_multi_cell_range(cf.sqref, idx, amount)
+        for rule in cf.rules:
+            rule.formula = [shift_formula(formula, idx, amount, ws.title) for formula in rule.formula]
+            conditional_formatting.add(str(sqref), rule)
+    ws.conditional_formatting = conditional_formatting
+
+    for validation in ws.data_validations.dataValidation:
+        validation.sqref = shift_multi_cell_range(validation.sqref, idx, amount)
+
+    if ws.auto_filter.ref:
+        ws.auto_filter.ref = shift_cell_range(CellRange(ws.auto_filter.ref), idx, amount).coord
+
+    shift_hyperlinks(ws, idx, amount)
+    shift_defined_names(ws, idx, amount)
+
+    if ws.print_area:
+        ws.print_area = shift_formula(ws.print_area, idx, amount, ws.title, own_sheet=False)
+    if ws.print_title_cols:
+        ws.print_title_cols = shift_reference(ws.print_title_cols, idx, amount, ws.title, own_sheet=True)
+
+
+def shift_hyperlinks(ws, idx, amount):
+    """
+    Сдвигает адреса гиперссылок листа и внутренние ссылки всех листов книги на сдвинутые ячейки.
+    """
+    for sheet in ws.parent.worksheets:
+        own_sheet = sheet is ws
+        for cell in sheet._cells.values():
+            link = getattr(cell, 'hyperlink', None)
+            if link is None:
+                continue
+            # Гиперссылки записываются в файл по своему адресу ref, а не по положению ячейки
+            if own_sheet:
+                link.ref = shift_cell_range(CellRange(link.ref), idx, amount).coord if link.ref else cell.coordinate
+            if link.location:
+                link.location = shift_reference(link.location, idx, amount, ws.title, own_sheet)
+
+
+def shift_defined_names(ws, idx, amount):
+    """
+    Сдвигает ссылки именованных диапазонов книги и листов на столбцы листа ws.
+    """
+    scopes = [ws.parent.defined_names] + [sheet.defined_names for sheet in ws.parent.worksheets]
+    for defined_names in scopes:
+        for defined_name in defined_names.values():
+            if defined_name.attr_text:
+                defined_name.attr_text = shift_formula(defined_name.attr_text, idx, amount, ws.title,
+                                                       own_sheet=False)
+
+
+def shift_column_dimensions(ws, idx, amount):
+    """
+    Сдвигает описания столбцов (ширина, скрытие, группировка) и задает новым столбцам ширину столбца слева.
+    """
+    dimensions = list(ws.column_dimensions.values())
+    left_dimension = None
+    for dimension in dimensions:
+        dimension.reindex()
+        if idx > 1 and dimension.min <= idx - 1 <= dimension.max:
+            left_dimension = dimension
+
+    ws.column_dimensions.clear()
+    for dimension in dimensions:
+        if dimension.min >= idx:
+            dimension.min += amount
+            dimension.max += amount
+        elif dimension.max >= idx:
+            dimension.max += amount
+        dimension.index = get_column_letter(dimension.min)
+        ws.column_dimensions[dimension.index] = dimension
+
+    if left_dimension is not None and left_dimension.max < idx:
+        new_dimension = copy.copy(left_dimension)
+        new_dimension.index = get_column_letter(idx)
+        new_dimension.min = idx
+        new_dimension.max = idx + amount - 1
+        ws.column_dimensions[new_dimension.index] = new_dimension
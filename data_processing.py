@@ -1,5 +1,15 @@
+import hashlib
+import numpy as np
+import openpyxl
 import pandas as pd
 import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from openpyxl.worksheet.formula import ArrayFormula, DataTableFormula
+
+import instrumentation
+from cache import cache_load, cache_store, default_cache_dir, file_fingerprint, make_cache_key
 
 # Словари для определения вида продукта
 zalogovye = [
@@ -10,39 +20,332 @@ bezzalogovye = [
     "микрозаймы физическим лицам", "карта рассрочка", "Овердрафт"
 ]
 
+# Столбцы, которые используются из основной базы
+expected_columns = ['ТИП кредита', 'Результат', 'Деления']
+
+# Вид продукта -> список типов кредита; можно передать свой словарь в load_excel
+product_kinds = {'Залоговый': zalogovye, 'Беззалоговый': bezzalogovye}
+undefined_product_kind = 'Неопределенный'
+
+# Названия итоговых строк по виду продукта
+product_kind_totals = {'Залоговый': 'Всего залоговые', 'Беззалоговый': 'Всего без залоговые'}
+
+# Порядок столбцов результата в итоговых таблицах
+column_order = [
+    'Дал обещание', 'Не звонили', 'Дал номер клиента', 'Клиент заграницей',
+    'Обещал связаться с клиентом', 'Связался с клиентом и сообщил', 'Частично оплатил', 'Не дозвон',
+    'Бросил трубку', 'Другой номер', 'Не знаком с клиентом', 'Дело в суде', 'Клиент умер',
+    'Отказывается от оплаты', 'Отказывается от разговора', 'Итог'
+]
+
 
-def load_excel(file_path, sheet_name, header_row=0):
+def load_excel(file_path, sheet_name, header_row=0, product_kind_mapping=None, cache_dir=None,
+               cache_by_content=False, streaming=False, divisions=None):
     """
-    Загружает данные из Excel файла и возвращает DataFrame.
+    Загружает данные из Excel, CSV, Parquet или Arrow (Feather) файла и возвращает DataFrame.
+    Формат определяется по расширению; для CSV, Parquet и Arrow читаются только нужные столбцы, sheet_name не используется.
+    product_kind_mapping - словарь вида продукта и списка типов кредита (по умолчанию product_kinds).
+    cache_dir - каталог кэша снимков нужных столбцов; ключ строится по пути, листу, строке заголовков
+    и размеру/времени изменения файла (или хэшу содержимого при cache_by_content=True).
+    streaming - читать лист построчно через openpyxl в режиме read_only, сохраняя только нужные столбцы.
+    divisions - оставить только строки этих делений; для Parquet фильтр передается в чтение групп строк.
     """
     if not os.path.isfile(file_path):
         print(f"Error: File {file_path} does not exist.")
         return None
     try:
-        # Загрузка всех данных
-        df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row)
-        print(f"Successfully loaded {file_path} with sheet {sheet_name}")
+        df = None
+        if cache_dir:
+            key = make_cache_key('snapshot', file_fingerprint(file_path, cache_by_content), sheet_name, header_row,
+                                 expected_columns, sorted(map(repr, divisions)) if divisions is not None else None)
+            df = load_snapshot(cache_dir, key)
+            if df is not None:
+                print(f"Loaded {file_path} with sheet {sheet_name} from cache")
 
-        # Оставляем только нужные столбцы, если они присутствуют
-        expected_columns = ['ТИП кредита', 'Результат', 'Деления']
-        existing_columns = [col for col in expected_columns if col in df.columns]
-
-        if not existing_columns:
-            print(f"None of the expected columns found in {file_path} on sheet {sheet_name}.")
-            return None
-
-        df = df[existing_columns]
+        if df is None:
+            file_format = input_format(file_path)
+            with instrumentation.stage('load_base', streaming=streaming, format=file_format) as stage:
+                if file_format == 'csv':
+                    df = filter_divisions(read_csv_columns(file_path, header_row), divisions)
+                elif file_format in ('parquet', 'ipc'):
+                    df = read_dataset_columns(file_path, file_format, divisions)
+                elif streaming:
+                    df = filter_divisions(stream_expected_columns(file_path, sheet_name, header_row), divisions)
+                else:
+                    df = filter_divisions(read_expected_columns(file_path, sheet_name, header_row), divisions)
+                if df is not None:
+                    stage['rows'] = len(df)
+                    stage['cells'] = df.size
+            if df is None:
+                return None
+            if cache_dir:
+                store_snapshot(cache_dir, key, df)
 
         # Проверка наличия столбца "Вид продукта" и заполнение его значениями при отсутствии
         if 'Вид продукта' not in df.columns and 'ТИП кредита' in df.columns:
-            df['Вид продукта'] = df['ТИП кредита'].apply(assign_product_kind)
+            df['Вид продукта'] = classify_product_kinds(df['ТИП кредита'], product_kind_mapping)
 
-        return df
+        # Столбцы-измерения хранятся как категориальные с единым словарем категорий
+        return categorize_dimensions(df, product_kind_mapping)
     except Exception as e:
         print(f"Error loading Excel file {file_path} on sheet {sheet_name}: {e}")
         return None
 
 
+def input_format(file_path):
+    """
+    Определяет формат основной базы по расширению файла: 'csv', 'parquet', 'ipc' (Arrow/Feather) или 'excel'.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    if extension in ('.arrow', '.feather', '.ipc'):
+        return 'ipc'
+    return 'excel'
+
+
+def filter_divisions(df, divisions=None):
+    """
+    Оставляет только строки указанных делений (все строки, если divisions не задан).
+    """
+    if df is None or divisions is None or 'Деления' not in df.columns:
+        return df
+    return df[df['Деления'].isin(list(divisions))].reset_index(drop=True)
+
+
+def read_csv_columns(file_path, header_row=0):
+    """
+    Читает из CSV только нужные столбцы.
+    """
+    df = pd.read_csv(file_path, header=header_row, usecols=lambda col: col in expected_columns)
+    print(f"Successfully loaded {file_path}")
+    existing_columns = [col for col in expected_columns if col in df.columns]
+    if not existing_columns:
+        print(f"None of the expected columns found in {file_path}.")
+        return None
+    return df[existing_columns]
+
+
+def open_dataset(file_path, file_format):
+    """
+    Открывает Parquet или Arrow файл как pyarrow.dataset (pyarrow - необязательная зависимость).
+    """
+    try:
+        import pyarrow.dataset as ds
+    except ImportError as e:
+        raise ImportError("Reading Parquet and Arrow files requires pyarrow (pip install pyarrow)") from e
+    return ds, ds.dataset(file_path, format=file_format)
+
+
+def dataset_scan_arguments(ds, dataset, divisions=None):
+    """
+    Нужные столбцы набора данных и фильтр по делениям, который pyarrow применяет при чтении
+    (группы строк Parquet, не содержащие нужных делений по статистике, пропускаются).
+    """
+    existing_columns = [col for col in expected_columns if col in dataset.schema.names]
+    division_filter = None
+    if divisions is not None and 'Деления' in existing_columns:
+        division_filter = ds.field('Деления').isin(list(divisions))
+    return existing_columns, division_filter
+
+
+def read_dataset_columns(file_path, file_format, divisions=None):
+    """
+    Читает из Parquet или Arrow файла только нужные столбцы и, при заданном divisions, только строки этих делений.
+    """
+    ds, dataset = open_dataset(file_path, file_format)
+    existing_columns, division_filter = dataset_scan_arguments(ds, dataset, divisions)
+    if not existing_columns:
+        print(f"None of the expected columns found in {file_path}.")
+        return None
+    df = dataset.to_table(columns=existing_columns, filter=division_filter).to_pandas()
+    print(f"Successfully loaded {file_path}")
+    return df
+
+
+def iter_dataset_chunks(file_path, file_format, chunk_rows=100_000, divisions=None):
+    """
+    Отдает части Parquet или Arrow файла по chunk_rows строк только с нужными столбцами.
+    """
+    ds, dataset = open_dataset(file_path, file_format)
+    existing_columns, division_filter = dataset_scan_arguments(ds, dataset, divisions)
+    if not existing_columns:
+        print(f"None of the expected columns found in {file_path}.")
+        return
+    for batch in dataset.to_batches(columns=existing_columns, filter=division_filter, batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def read_expected_columns(file_path, sheet_name, header_row=0):
+    """
+    Читает лист Excel и оставляет только нужные столбцы, если они присутствуют.
+    """
+    # Загрузка всех данных
+    df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row)
+    instrumentation.count('workbook_loads')
+    print(f"Successfully loaded {file_path} with sheet {sheet_name}")
+
+    # Оставляем только нужные столбцы, если они присутствуют
+    existing_columns = [col for col in expected_columns if col in df.columns]
+
+    if not existing_columns:
+        print(f"None of the expected columns found in {file_path} on sheet {sheet_name}.")
+        return None
+
+    return df[existing_columns].copy()
+
+
+def stream_expected_columns(file_path, sheet_name, header_row=0, chunk_rows=100_000):
+    """
+    Читает только нужные столбцы построчно в режиме read_only и собирает их как категориальные столбцы.
+    Пиковая память зависит от количества строк и трех нужных столбцов, а не от ширины листа.
+    Словарь категорий столбца общий для всех частей и пополняется по мере появления значений,
+    поэтому части с пустыми столбцами или смешанными числами и строками собираются без ошибок.
+    """
+    dictionaries = None
+    codes = None
+    for chunk in iter_excel_chunks(file_path, sheet_name, header_row, chunk_rows):
+        if dictionaries is None:
+            dictionaries = {col: {} for col in chunk.columns}
+            codes = {col: [] for col in chunk.columns}
+        for col in chunk.columns:
+            chunk_codes, uniques = pd.factorize(chunk[col].to_numpy(dtype=object))
+            dictionary = dictionaries[col]
+            mapping = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques] + [-1],
+                               dtype=np.int64)
+            codes[col].append(mapping[chunk_codes])  # код -1 (пусто) указывает на последний элемент mapping
+    if dictionaries is None:
+        return None
+    return pd.DataFrame({col: pd.Categorical.from_codes(np.concatenate(codes[col]),
+                                                        categories=pd.Index(list(dictionaries[col]), dtype=object))
+                         for col in dictionaries})
+
+
+def iter_excel_chunks(file_path, sheet_name, header_row=0, chunk_rows=100_000):
+    """
+    Построчно читает лист в режиме read_only и отдает части по chunk_rows строк только с нужными столбцами.
+    Строки, где все нужные столбцы пусты, пропускаются: они не участвуют ни в одной таблице.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    instrumentation.count('workbook_loads')
+    try:
+        sheet = workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(islice(rows, header_row, None), None) or ()
+        print(f"Successfully opened {file_path} with sheet {sheet_name} for streaming")
+
+        # Позиции нужных столбцов по строке заголовков (первое вхождение, как в read_excel)
+        positions = {}
+        for idx, name in enumerate(header):
+            if name in expected_columns and name not in positions:
+                positions[name] = idx
+        existing_columns = [col for col in expected_columns if col in positions]
+
+        if not existing_columns:
+            print(f"None of the expected columns found in {file_path} on sheet {sheet_name}.")
+            return
+
+        indexes = [positions[col] for col in existing_columns]
+        buffer = []
+        emitted = False
+        for row in rows:
+            values = tuple(row[idx] if idx < len(row) else None for idx in indexes)
+            if all(value is None for value in values):
+                continue
+            buffer.append(values)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=existing_columns, dtype=object)
+                buffer = []
+                emitted = True
+        if buffer or not emitted:
+            yield pd.DataFrame(buffer, columns=existing_columns, dtype=object)
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(file_path, header_row=0, chunk_rows=100_000):
+    """
+    Читает CSV частями по chunk_rows строк, загружая только нужные столбцы.
+    """
+    reader = pd.read_csv(file_path, header=header_row, usecols=lambda col: col in expected_columns,
+                         chunksize=chunk_rows)
+    with reader:
+        for chunk in reader:
+            yield chunk[[col for col in expected_columns if col in chunk.columns]]
+
+
+def iter_input_chunks(file_path, sheet_name=None, header_row=0, chunk_rows=100_000, divisions=None):
+    """
+    Отдает части основной базы с нужными столбцами в зависимости от формата файла.
+    divisions - оставить только строки этих делений.
+    """
+    file_format = input_format(file_path)
+    if file_format in ('parquet', 'ipc'):
+        return iter_dataset_chunks(file_path, file_format, chunk_rows, divisions)
+    if file_format == 'csv':
+        chunks = iter_csv_chunks(file_path, header_row, chunk_rows)
+    else:
+        chunks = iter_excel_chunks(file_path, sheet_name, header_row, chunk_rows)
+    if divisions is None:
+        return chunks
+    return (filter_divisions(chunk, divisions) for chunk in chunks)
+
+
+def store_snapshot(cache_dir, key, df):
+    """
+    Сохраняет компактный снимок нужных столбцов: нечисловые столбцы хранятся как категориальные.
+    """
+    snapshot = df.astype({col: 'category' for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])})
+    cache_store(cache_dir, key, (snapshot, df.dtypes.to_dict()))
+
+
+def load_snapshot(cache_dir, key):
+    """
+    Загружает снимок из кэша и возвращает столбцам исходные типы данных.
+    """
+    entry = cache_load(cache_dir, key)
+    if entry is None:
+        return None
+    snapshot, dtypes = entry
+    return snapshot.astype(dtypes)
+
+
+def known_dimension_values(product_kind_mapping=None):
+    """
+    Возвращает фиксированные значения столбцов-измерений, с которых начинается их словарь категорий.
+    """
+    if product_kind_mapping is None:
+        product_kind_mapping = product_kinds
+    return {
+        'ТИП кредита': list(dict.fromkeys(t for types in product_kind_mapping.values() for t in types)),
+        'Вид продукта': sorted(set(product_kind_mapping) | {undefined_product_kind}),
+        'Результат': column_order,
+        'Деления': [],
+    }
+
+
+def categorize_dimensions(df, product_kind_mapping=None):
+    """
+    Переводит столбцы-измерения в категориальные. Словарь категорий начинается с фиксированных значений
+    (типы кредита из product_kind_mapping, виды продукта, column_order для результатов), и только они получают
+    одинаковые коды в любой загрузке. Остальные встретившиеся значения, в том числе все деления, добавляются
+    после них по алфавиту, поэтому их коды зависят от набора значений в конкретной базе.
+    """
+    for column, known in known_dimension_values(product_kind_mapping).items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        observed = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else values.dropna().unique()
+        known_set = set(known)
+        extra = sorted((value for value in observed if value not in known_set), key=str)
+        categories = known + extra
+        if not (isinstance(values.dtype, pd.CategoricalDtype) and list(values.cat.categories) == categories):
+            df[column] = pd.Categorical(values, categories=categories)
+    return df
+
+
 def assign_product_kind(credit_type):
     """
     Определяет вид продукта на основе типа кредита.
@@ -55,6 +358,35 @@ def assign_product_kind(credit_type):
         return 'Неопределенный'
 
 
+def build_product_kind_lookup(product_kind_mapping=None):
+    """
+    Строит словарь "тип кредита -> вид продукта" из словаря "вид продукта -> список типов кредита".
+    При повторе типа в нескольких видах побеждает первый, как в assign_product_kind.
+    """
+    if product_kind_mapping is None:
+        product_kind_mapping = product_kinds
+    lookup = {}
+    for kind, credit_types in product_kind_mapping.items():
+        for credit_type in credit_types:
+            lookup.setdefault(credit_type, kind)
+    return lookup
+
+
+def classify_product_kinds(credit_types, product_kind_mapping=None):
+    """
+    Определяет вид продукта для всего столбца типов кредита за один векторный шаг.
+    Каждое уникальное значение классифицируется один раз, затем результат раскладывается по кодам.
+    """
+    lookup = build_product_kind_lookup(product_kind_mapping)
+    categories = known_dimension_values(product_kind_mapping)['Вид продукта']
+    positions = {kind: i for i, kind in enumerate(categories)}
+    codes, uniques = pd.factorize(credit_types)
+    # Последний элемент таблицы соответствует коду -1 (пустые значения)
+    kind_codes = np.array([positions[lookup.get(value, undefined_product_kind)] for value in uniques]
+                          + [positions[undefined_product_kind]], dtype=np.int32)
+    return pd.Series(pd.Categorical.from_codes(kind_codes[codes], categories), index=credit_types.index)
+
+
 def count_unique_values(df, type_column, product_kind_column, result_column):
     """
     Подсчитывает количество уникальных значений в столбце результата для каждого уникального значения в столбце типа и вида продукта.
@@ -103,35 +435,113 @@ def count_unique_values(df, type_column, product_kind_column, result_column):
         return None
 
 
+class DivisionPartitions(Mapping):
+    """
+    Ленивое разбиение DataFrame по делениям: строки группируются один раз,
+    DataFrame деления создается только при обращении к нему.
+    Порядок делений совпадает с порядком их первого появления; строки без деления не попадают ни в одно деление.
+    """
+
+    def __init__(self, df, division_column):
+        self.df = df
+        self.division_column = division_column
+        codes, uniques = pd.factorize(df[division_column])
+        # Позиции строк, сгруппированные по делениям, и границы групп в этом массиве
+        self.order = np.argsort(codes, kind='stable')
+        sizes = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        self.bounds = np.concatenate([[0], np.cumsum(sizes)]) + np.count_nonzero(codes < 0)
+        self.divisions = {division: i for i, division in enumerate(uniques)}
+
+    def positions(self, division):
+        """
+        Возвращает позиции строк деления в исходном DataFrame.
+        """
+        i = self.divisions[division]
+        return self.order[self.bounds[i]:self.bounds[i + 1]]
+
+    def __getitem__(self, division):
+        return self.df.iloc[self.positions(division)]
+
+    def __iter__(self):
+        return iter(self.divisions)
+
+    def __len__(self):
+        return len(self.divisions)
+
+
 def create_dataframes_by_division(df, division_column):
     """
     Создает отдельные DataFrame для каждой уникальной категории в столбце "Деления".
+    Возвращает DivisionPartitions: DataFrame деления создается только при обращении к нему.
     """
     try:
         if division_column not in df.columns:
             print(f"Column '{division_column}' not found in DataFrame")
             print(f"Available columns: {df.columns.tolist()}")
             return None
-        unique_divisions = df[division_column].unique()
-        dataframes = {division: df[df[division_column] == division] for division in unique_divisions}
-        return dataframes
+        return DivisionPartitions(df, division_column)
     except Exception as e:
         print(f"Error creating dataframes by division: {e}")
         return None
 
 
-def find_ordered_types_in_report(file_path, sheet_name, unique_types):
+def scan_ordered_types(sheet, unique_types, stop_on_formula=False):
+    """
+    Возвращает ключевые слова листа в порядке появления и число просмотренных строк.
+    При stop_on_formula возвращает None, если до нахождения всех ключевых слов встретилась формула.
+    """
+    remaining = set(unique_types)
+    ordered_types = []
+    rows = 0
+    # Первая строка листа - строка заголовков, как при чтении через read_excel
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        rows += 1
+        for cell_value in row:
+            if stop_on_formula and is_formula_value(cell_value):
+                return None, rows
+            if cell_value in remaining:
+                remaining.discard(cell_value)
+                ordered_types.append(cell_value)
+        if not remaining:
+            break
+    return ordered_types, rows
+
+
+def is_formula_value(cell_value):
+    """
+    Проверяет, что значение ячейки из книги без data_only - это формула, а не ее сохраненное значение.
+    """
+    if isinstance(cell_value, str):
+        return cell_value.startswith('=')
+    return isinstance(cell_value, (ArrayFormula, DataTableFormula))
+
+
+def find_ordered_types_in_report(file_path, sheet_name, unique_types, workbook=None):
     """
     Ищет ключевые слова в указанном файле и листе и возвращает их в порядке появления, игнорируя остальные значения.
+    Лист читается построчно в режиме read_only и data_only; поиск останавливается, как только найдены все ключевые слова.
+    Если передан уже открытый workbook, сначала просматривается он. Такая книга обычно открыта без data_only,
+    и в ячейках с формулами лежит текст формулы, а не значение; если формула встретилась раньше,
+    чем найдены все ключевые слова, поиск повторяется по сохраненным значениям файла.
     """
     try:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)  # Загружаем все столбцы
+        if workbook is not None:
+            with instrumentation.stage('ordered_types') as stage:
+                ordered_types, stage['rows'] = scan_ordered_types(workbook[sheet_name], unique_types,
+                                                                  stop_on_formula=True)
+            if ordered_types is not None:
+                return ordered_types
+            print(f"Formula cells found in sheet {sheet_name}; reading cached values from {file_path}.")
+
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        instrumentation.count('workbook_loads')
         print(f"Successfully loaded {file_path} with sheet {sheet_name} for ordered types.")
+        try:
+            with instrumentation.stage('ordered_types') as stage:
+                ordered_types, stage['rows'] = scan_ordered_types(workbook[sheet_name], unique_types)
+        finally:
+            workbook.close()
 
-        ordered_types = []
-        for cell_value in df.to_numpy().flatten():
-            if cell_value in unique_types and cell_value not in ordered_types:
-                ordered_types.append(cell_value)
         return ordered_types
     except Exception as e:
         print(f"Error loading Excel file {file_path} on sheet {sheet_name}: {e}")
@@ -143,38 +553,346 @@ def reorder_dataframe(df, type_column, ordered_types):
     Упорядочивает DataFrame в соответствии с порядком значений в столбце type_column.
     """
     df[type_column] = pd.Categorical(df[type_column], categories=ordered_types, ordered=True)
-    return df.sort_values(by=type_column)
+    # Устойчивая сортировка сохраняет порядок строк внутри типа, от него зависит порядок делений
+    return df.sort_values(by=type_column, kind='stable')
+
+
+def count_combinations(df, division_column, type_column, product_kind_column, result_column):
+    """
+    Подсчитывает количество строк для каждого сочетания (деление, тип кредита, вид продукта, результат)
+    за один сгруппированный проход. Строки без деления или без результата не попадают ни в одну таблицу.
+    """
+    counts = df.groupby([division_column, type_column, product_kind_column, result_column],
+                        observed=True, dropna=False, sort=False).size()
+    # Группировка по категориальным столбцам идет по кодам; уровни индекса переводятся в обычные значения,
+    # чтобы сортировка строк и объединение частей шли по самим значениям, а не по кодам
+    counts.index = counts.index.set_levels([level.astype(level.categories.dtype) if isinstance(level, pd.CategoricalIndex)
+                                            else level for level in counts.index.levels])
+    return counts[counts.index.get_level_values(0).notna() & counts.index.get_level_values(3).notna()]
+
+
+def split_counts(counts, type_labels=None):
+    """
+    Разворачивает подсчеты сочетаний в две таблицы с MultiIndex (деление, значение) и столбцами по результатам:
+    по типу кредита и по виду продукта. Если передан type_labels, в таблицу типов попадают только эти типы.
+    """
+    types = counts.index.get_level_values(1)
+    type_mask = types.notna()
+    if type_labels is not None:
+        type_mask &= types.isin(list(type_labels))
+    type_counts = counts[type_mask].groupby(level=[0, 1, 3], observed=True, sort=False).sum().unstack(-1, fill_value=0)
+    kind_counts = counts[counts.index.get_level_values(2).notna()]
+    kind_counts = kind_counts.groupby(level=[0, 2, 3], observed=True, sort=False).sum().unstack(-1, fill_value=0)
+
+    results = type_counts.columns.union(kind_counts.columns)
+    type_counts = type_counts.reindex(columns=results, fill_value=0)
+    kind_counts = kind_counts.reindex(columns=results, fill_value=0)
+    type_counts.index.names = kind_counts.index.names = ['division', 'label']
+    return type_counts, kind_counts
+
+
+def build_count_cube(df, division_column, type_column, product_kind_column, result_column):
+    """
+    Подсчитывает количество результатов по (деление × тип кредита) и (деление × вид продукта)
+    за один сгруппированный проход по всему DataFrame.
+    Возвращает две таблицы с MultiIndex (деление, значение) и столбцами по результатам.
+    """
+    counts = count_combinations(df, division_column, type_column, product_kind_column, result_column)
+    return split_counts(counts)
+
+
+def build_division_tables(type_counts, kind_counts, divisions, type_labels=None):
+    """
+    Собирает из куба подсчетов таблицы для каждого деления и таблицу "Общий итог".
+    Результат совпадает с count_unique_values + apply_structure_and_sorting для каждого деления.
+    """
+    results = type_counts.columns
+
+    # Строки по типу кредита: все категории упорядоченного типа или наблюдаемые значения по алфавиту
+    if type_labels is not None:
+        type_rows = type_counts.reindex(pd.MultiIndex.from_product([divisions, type_labels],
+                                                                   names=type_counts.index.names), fill_value=0)
+    else:
+        type_rows = type_counts.iloc[type_counts.index.get_level_values('label').argsort(kind='stable')]
+
+    # Строки по виду продукта: наблюдаемые значения по алфавиту с заменой названий
+    kind_rows = kind_counts.iloc[kind_counts.index.get_level_values('label').argsort(kind='stable')]
+    kind_rows = kind_rows.rename(index=product_kind_totals, level='label')
+
+    type_rows = type_rows.assign(Итог=type_rows[results].sum(axis=1))
+    kind_rows = kind_rows.assign(Итог=kind_rows[results].sum(axis=1))
+    rows = pd.concat([type_rows, kind_rows])
+
+    # Строка "Итого": count_unique_values и apply_structure_and_sorting суммируют таблицу вместе с уже
+    # посчитанной строкой, поэтому по результатам она равна удвоенной сумме строк, а "Итог" - учетверенной
+    sums = rows.groupby(level='division', sort=False).sum()
+    itogo = sums * 2
+    itogo['Итог'] = sums['Итог'] * 4
+    pair_rows = kind_rows[kind_rows.index.get_level_values('label').isin(list(product_kind_totals.values()))]
+    pair_groups = pair_rows.groupby(level='division', sort=False)['Итог']
+    pair_count = pair_groups.size()
+    has_pair = pair_count[pair_count == len(product_kind_totals)].index
+    itogo.loc[has_pair, 'Итог'] = pair_groups.sum().loc[has_pair]
+    itogo.index = pd.MultiIndex.from_arrays([itogo.index, ['Итого'] * len(itogo)], names=rows.index.names)
+
+    tables = pd.concat([itogo, rows])
+    present = sums[results] > 0
+    groups = dict(iter(tables.groupby(level='division', sort=False)))
+
+    processed_dataframes = {}
+    for division in divisions:
+        if division not in groups:
+            continue
+        division_results = set(results[present.loc[division].to_numpy()])
+        cols = [col for col in column_order if col in division_results or col == 'Итог']
+        table = groups[division].droplevel('division')[cols]
+        table.index.name = None
+        processed_dataframes[division] = table
+
+    # Общий итог суммируется из того же куба
+    if processed_dataframes:
+        overall_summary = tables.groupby(level='label').sum()
+        overall_summary.index.name = None
+        overall_summary = apply_structure_and_sorting(overall_summary)
+        processed_dataframes['Общий итог'] = overall_summary
+
+    return processed_dataframes
+
+
+class CountAccumulator:
+    """
+    Накапливает подсчеты результатов по частям основной базы, не держа в памяти весь DataFrame.
+    Память ограничена количеством сочетаний (деление, тип кредита, вид продукта, результат).
+    """
+
+    def __init__(self, division_column, type_column, product_kind_column, result_column,
+                 product_kind_mapping=None):
+        self.division_column = division_column
+        self.type_column = type_column
+        self.product_kind_column = product_kind_column
+        self.result_column = result_column
+        self.product_kind_mapping = product_kind_mapping
+        self.counts = None
+        self.rows = 0
+        # Первая позиция строки каждого сочетания (деление, тип кредита) во всей базе
+        self.first_positions = {}
+
+    def update(self, chunk):
+        """
+        Добавляет подсчеты очередной части данных.
+        """
+        if self.product_kind_column not in chunk.columns and self.type_column in chunk.columns:
+            chunk = chunk.assign(**{self.product_kind_column: classify_product_kinds(chunk[self.type_column],
+                                                                                      self.product_kind_mapping)})
+        counts = count_combinations(chunk, self.division_column, self.type_column, self.product_kind_column,
+                                    self.result_column)
+        if self.counts is not None:
+            counts = pd.concat([self.counts, counts]).groupby(level=[0, 1, 2, 3], sort=False, dropna=False).sum()
+        self.counts = counts
+        if self.division_column in chunk.columns:
+            key_columns = [col for col in (self.division_column, self.type_column) if col in chunk.columns]
+            keys = chunk[key_columns].reset_index(drop=True)
+            keys = keys[keys[self.division_column].notna()].drop_duplicates()
+            for position, values in zip(keys.index, keys.itertuples(index=False)):
+                division = values[0]
+                credit_type = values[1] if len(values) > 1 and not pd.isna(values[1]) else None
+                self.first_positions.setdefault((division, credit_type), self.rows + position)
+        self.rows += len(chunk)
+
+    def unique_types(self):
+        """
+        Возвращает уникальные типы кредита, встретившиеся во всех частях.
+        """
+        if self.counts is None:
+            return []
+        return self.counts.index.get_level_values(1).dropna().unique().tolist()
+
+    def division_order(self, ordered_types=None):
+        """
+        Возвращает деления в порядке первого появления в базе, отсортированной по типам кредита
+        (reorder_dataframe), как в process_dataframe: сначала по месту типа в ordered_types
+        (прочие и пустые типы - в конце), затем по позиции строки.
+        """
+        ranks = {credit_type: rank for rank, credit_type in enumerate(ordered_types or [])}
+        first = {}
+        for (division, credit_type), position in self.first_positions.items():
+            key = (ranks.get(credit_type, len(ranks)), position)
+            if division not in first or key < first[division]:
+                first[division] = key
+        return sorted(first, key=first.get)
+
+    def result(self, ordered_types=None):
+        """
+        Собирает таблицы по делениям и "Общий итог" в том же виде и порядке, что и process_dataframes.
+        ordered_types - порядок типов кредита из отчета; остальные типы учитываются только в видах продукта.
+        """
+        if self.counts is None:
+            return {}
+        type_counts, kind_counts = split_counts(self.counts, ordered_types)
+        return build_division_tables(type_counts, kind_counts, self.division_order(ordered_types), ordered_types)
+
+
+def process_dataframe(df, division_column, type_column, product_kind_column, result_column):
+    """
+    Обрабатывает весь DataFrame за один проход и возвращает таблицы по каждому делению и "Общий итог".
+    """
+    try:
+        with instrumentation.stage('aggregate', rows=len(df)) as stage:
+            type_counts, kind_counts = build_count_cube(df, division_column, type_column, product_kind_column,
+                                                        result_column)
+            divisions = df[division_column].dropna().unique().tolist()
+            type_labels = None
+            # Упорядоченный категориальный тип задается reorder_dataframe порядком типов из отчета
+            if isinstance(df[type_column].dtype, pd.CategoricalDtype) and df[type_column].cat.ordered:
+                type_labels = df[type_column].cat.categories
+            tables = build_division_tables(type_counts, kind_counts, divisions, type_labels)
+            stage['cells'] = sum(table.size for table in tables.values())
+        return tables
+    except Exception as e:
+        print(f"Error processing dataframe: {e}")
+        return None
 
 
 def process_dataframes(dataframes, type_column, product_kind_column, result_column):
     """
     Обрабатывает каждый DataFrame для дальнейшего использования в другом модуле.
     """
+    if not dataframes:
+        return {}
+    # Разбиение по делениям считается сразу по исходному DataFrame без копирования частей
+    if isinstance(dataframes, DivisionPartitions):
+        return process_dataframe(dataframes.df, dataframes.division_column, type_column, product_kind_column,
+                                 result_column)
+    # Все деления склеиваются в один DataFrame и считаются одним сгруппированным проходом
+    df = pd.concat(list(dataframes.values()), keys=list(dataframes.keys()), names=['_division'])
+    df = df.reset_index(level='_division')
+    return process_dataframe(df, '_division', type_column, product_kind_column, result_column)
+
+
+def division_fingerprints(df, division_column, type_column, product_kind_column, result_column):
+    """
+    Возвращает отпечаток строк каждого деления: количество строк и сумму хэшей строк по нужным столбцам.
+    Отпечаток не зависит от порядка строк, поэтому перестановка строк в базе не считается изменением.
+    """
+    partitions = DivisionPartitions(df, division_column)
+    if not len(partitions):
+        return {}
+    hashes = pd.util.hash_pandas_object(df[[type_column, product_kind_column, result_column]], index=False)
+    hashes = hashes.to_numpy()[partitions.order]
+    starts = partitions.bounds[:-1]
+    # Сумма по модулю 2**64: переполнение uint64 в numpy не проверяется
+    sums = np.add.reduceat(hashes, starts)
+    sizes = np.diff(partitions.bounds)
+    return {division: (int(sizes[i]), int(sums[i])) for division, i in partitions.divisions.items()}
+
+
+def tables_cache_key(df, division_column, type_column, product_kind_column, result_column):
+    """
+    Ключ кэша таблиц: хэш содержимого нужных столбцов и порядок типов кредита из отчета.
+    """
+    columns = [division_column, type_column, product_kind_column, result_column]
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    digest = hashlib.sha1(row_hashes.tobytes()).hexdigest()
+    ordered_types = None
+    if isinstance(df[type_column].dtype, pd.CategoricalDtype) and df[type_column].cat.ordered:
+        ordered_types = df[type_column].cat.categories.tolist()
+    return make_cache_key('tables', columns, ordered_types, len(df), digest)
+
+
+def process_dataframe_cached(df, division_column, type_column, product_kind_column, result_column, cache_dir):
+    """
+    process_dataframe с кэшем результата на диске: при той же базе и том же порядке типов
+    (например, при смене только шаблона или выходного файла) таблицы не пересчитываются.
+    """
+    key = tables_cache_key(df, division_column, type_column, product_kind_column, result_column)
+    processed_dataframes = cache_load(cache_dir, key)
+    if processed_dataframes is not None:
+        instrumentation.count('tables_cache_hits')
+        print("Division tables loaded from cache.")
+        return processed_dataframes
+    processed_dataframes = process_dataframe(df, division_column, type_column, product_kind_column, result_column)
+    if processed_dataframes is not None:
+        cache_store(cache_dir, key, processed_dataframes)
+    return processed_dataframes
+
+
+def align_totals(totals, table):
+    """
+    Дополняет сумму нулями до строк и столбцов таблицы деления: при сложении с fill_value=0
+    ячейки, отсутствующие в обеих таблицах, иначе остались бы NaN.
+    """
+    return totals.reindex(index=totals.index.union(table.index), columns=totals.columns.union(table.columns),
+                          fill_value=0)
+
+
+def process_dataframe_incremental(df, division_column, type_column, product_kind_column, result_column, cache_dir):
+    """
+    Инкрементальный вариант process_dataframe: таблицы делений и отпечатки их строк хранятся в кэше,
+    пересчитываются только изменившиеся деления, а "Общий итог" обновляется вычитанием старых
+    и добавлением новых таблиц. Состояние привязано к набору столбцов и порядку типов кредита.
+    """
     try:
-        processed_dataframes = {}
-        for division, df in dataframes.items():
-            pivot_table = count_unique_values(df, type_column, product_kind_column, result_column)
-            if pivot_table is not None:
-                pivot_table = apply_structure_and_sorting(pivot_table)  # Применяем структуру и сортировку
-                processed_dataframes[division] = pivot_table
-                print(f"Data for division {division} successfully processed.")
-            else:
-                print(f"No data found for division {division}.")
-
-        # Добавление общего итогового DataFrame
-        overall_summary = pd.DataFrame()
-        for division, df in processed_dataframes.items():
-            # Преобразование всех значений к числовому типу данных перед добавлением
-            df = df.apply(pd.to_numeric, errors='coerce').fillna(0)
-            overall_summary = overall_summary.add(df, fill_value=0)
-
-        if not overall_summary.empty:
-            overall_summary = apply_structure_and_sorting(overall_summary)
-            processed_dataframes['Общий итог'] = overall_summary
+        fingerprints = division_fingerprints(df, division_column, type_column, product_kind_column, result_column)
+        type_labels = None
+        if isinstance(df[type_column].dtype, pd.CategoricalDtype) and df[type_column].cat.ordered:
+            type_labels = df[type_column].cat.categories.tolist()
+        key = make_cache_key('incremental', division_column, type_column, product_kind_column, result_column,
+                             type_labels)
+        state = cache_load(cache_dir, key)
+
+        if state is None:
+            processed_dataframes = process_dataframe(df, division_column, type_column, product_kind_column,
+                                                     result_column)
+            if processed_dataframes is None:
+                return None
+            tables = {division: table for division, table in processed_dataframes.items() if division != 'Общий итог'}
+            totals = pd.DataFrame()
+            for table in tables.values():
+                totals = align_totals(totals, table).add(table, fill_value=0)
+            print(f"Incremental state created for {len(tables)} divisions.")
+        else:
+            tables = state['tables']
+            totals = state['totals']
+            changed = [division for division, fingerprint in fingerprints.items()
+                       if state['fingerprints'].get(division) != fingerprint]
+            removed = [division for division in state['fingerprints'] if division not in fingerprints]
+            print(f"Incremental recompute: {len(changed)} changed, {len(removed)} removed, "
+                  f"{len(fingerprints) - len(changed)} unchanged divisions.")
+            if not changed and not removed:
+                return {**{division: tables[division] for division in fingerprints if division in tables},
+                        **({'Общий итог': state['overall']} if 'overall' in state else {})}
 
+            partitions = DivisionPartitions(df, division_column)
+            positions = np.concatenate([partitions.positions(division) for division in changed]) if changed else []
+            recomputed = process_dataframe(df.iloc[np.sort(positions)], division_column, type_column,
+                                           product_kind_column, result_column) if changed else {}
+            if recomputed is None:
+                return None
+
+            tables = dict(tables)
+            for division in changed + removed:
+                old_table = tables.pop(division, None)
+                if old_table is not None:
+                    totals = align_totals(totals, old_table).sub(old_table, fill_value=0)
+            for division in changed:
+                if division in recomputed:
+                    tables[division] = recomputed[division]
+                    totals = align_totals(totals, recomputed[division]).add(recomputed[division], fill_value=0)
+
+        # Строки и столбцы, которых больше нет ни в одном делении, удаляются из суммы, как при полном пересчете
+        labels = sorted(set().union(*(table.index for table in tables.values())))
+        columns = set().union(*(table.columns for table in tables.values()))
+        totals = totals.reindex(labels)[[col for col in totals.columns if col in columns]].round().astype('int64')
+
+        processed_dataframes = {division: tables[division] for division in fingerprints if division in tables}
+        new_state = {'fingerprints': fingerprints, 'tables': tables, 'totals': totals}
+        if processed_dataframes:
+            processed_dataframes['Общий итог'] = apply_structure_and_sorting(totals)
+            new_state['overall'] = processed_dataframes['Общий итог']
+        cache_store(cache_dir, key, new_state)
         return processed_dataframes
     except Exception as e:
-        print(f"Error processing dataframes: {e}")
+        print(f"Error processing dataframe incrementally: {e}")
         return None
 
 
@@ -198,23 +916,95 @@ def apply_structure_and_sorting(df):
     df = pd.concat([pd.DataFrame(itogo_row).T, df])
 
     # Перемещение столбца "Итог" в конец
-    column_order = [
-        'Дал обещание', 'Не звонили', 'Дал номер клиента', 'Клиент заграницей',
-        'Обещал связаться с клиентом', 'Связался с клиентом и сообщил', 'Частично оплатил', 'Не дозвон',
-        'Бросил трубку', 'Другой номер', 'Не знаком с клиентом', 'Дело в суде', 'Клиент умер',
-        'Отказывается от оплаты', 'Отказывается от разговора', 'Итог'
-    ]
-
     cols = [col for col in column_order if col in df.columns]
     df = df[cols]
 
     return df
 
 
+def compare_processed_dataframes(previous, current):
+    """
+    Сравнивает два результата process_dataframes (например, за две даты отчета) и возвращает для каждой
+    категории таблицу изменений: столбцы "Δ <результат>" (абсолютное изменение) и "Δ% <результат>"
+    (изменение в процентах к предыдущему значению; пусто, если предыдущее значение равно нулю).
+    Таблицы всех делений выравниваются по column_order и строкам типов/видов продукта и считаются разом.
+    """
+    if not previous or not current:
+        return {}
+    previous_all = pd.concat(previous, names=['division', 'label'])
+    current_all = pd.concat(current, names=['division', 'label'])
+
+    # Строки: сначала в порядке текущих таблиц, затем исчезнувшие; столбцы - в порядке column_order
+    index = current_all.index.append(previous_all.index.difference(current_all.index, sort=False))
+    columns = [col for col in column_order if col in previous_all.columns or col in current_all.columns]
+    previous_all = previous_all.reindex(index=index, columns=columns)
+    current_all = current_all.reindex(index=index, columns=columns)
+    present = (previous_all.notna() | current_all.notna()).groupby(level='division', sort=False).any()
+    previous_all = previous_all.fillna(0).astype('int64')
+    current_all = current_all.fillna(0).astype('int64')
+
+    absolute = current_all - previous_all
+    percent = (absolute / previous_all.where(previous_all != 0) * 100).round(1)
+    deltas = pd.concat([absolute.add_prefix('Δ '), percent.add_prefix('Δ% ')], axis=1)
+
+    comparison = {}
+    for division, table in deltas.groupby(level='division', sort=False):
+        division_columns = [col for col in columns if present.at[division, col]]
+        table = table.droplevel('division')[[f'Δ {col}' for col in division_columns]
+                                            + [f'Δ% {col}' for col in division_columns]]
+        table.index.name = None
+        # Пустые проценты не записываются в отчет
+        comparison[division] = table.astype(object).where(table.notna(), None)
+    return comparison
+
+
 def main(input_file, sheet_name, division_column, type_column, product_kind_column, result_column, report_file,
-         report_sheet, header_row=0):
+         report_sheet, header_row=0, product_kind_mapping=None, cache_dir=None, streaming=False, chunk_rows=None,
+         report_workbook=None, input_df=None, incremental=False, divisions=None, concurrent=False,
+         copy_input=True):
+    """
+    Загружает основную базу, определяет порядок типов по отчету и возвращает таблицы по делениям.
+    input_df - уже загруженная база (результат load_excel); тогда файл не читается, а DataFrame не изменяется.
+    copy_input=False - input_df принадлежит вызывающему только на время вызова и может быть изменен без копии.
+    divisions - строить таблицы только для этих делений (фильтр применяется при чтении базы).
+    concurrent - загружать базу в отдельном процессе, одновременно открывая книгу отчета в текущем.
+    incremental - пересчитывать только изменившиеся с прошлого запуска деления (нужен cache_dir).
+    cache_dir - каталог кэша (по умолчанию из переменной окружения REPORT_CACHE_DIR); с ним таблицы
+    запоминаются по содержимому базы и порядку типов.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    if chunk_rows and input_df is None:
+        return main_in_chunks(input_file, sheet_name, division_column, type_column, product_kind_column,
+                              result_column, report_file, report_sheet, header_row, chunk_rows, product_kind_mapping,
+                              report_workbook, cache_dir, divisions)
+
     # Шаг 1: Загрузка данных из основного Excel файла
-    df = load_excel(input_file, sheet_name, header_row)
+    if input_df is None and concurrent:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            base_future = pool.submit(load_excel, input_file, sheet_name, header_row, product_kind_mapping, cache_dir,
+                                      streaming=streaming, divisions=divisions)
+            # Пока база загружается, книга отчета открывается целиком со значениями формул: затем по ней
+            # выполняется поиск типов с ранним выходом в find_ordered_types_in_report
+            if report_workbook is None:
+                try:
+                    report_workbook = openpyxl.load_workbook(report_file, data_only=True)
+                    instrumentation.count('workbook_loads')
+                except Exception as e:
+                    print(f"Error loading Excel file {report_file} on sheet {report_sheet}: {e}")
+            df = base_future.result()
+    elif input_df is not None:
+        if divisions is not None and division_column in input_df.columns:
+            df = input_df[input_df[division_column].isin(list(divisions))]
+            if copy_input:
+                df = df.copy()
+        elif copy_input:
+            df = input_df.copy()
+        else:
+            df = input_df
+    else:
+        df = load_excel(input_file, sheet_name, header_row, product_kind_mapping, cache_dir, streaming=streaming,
+                        divisions=divisions)
     if df is None:
         return None
 
@@ -225,7 +1015,7 @@ def main(input_file, sheet_name, division_column, type_column, product_kind_colu
     print(f"Unique types in the base data: {unique_types}")
 
     # Шаг 3: Получение упорядоченного списка "ТИП кредита" из отчета
-    ordered_types = find_ordered_types_in_report(report_file, report_sheet, unique_types)
+    ordered_types = find_ordered_types_in_report(report_file, report_sheet, unique_types, report_workbook)
     if not ordered_types:
         print(f"No ordered types found in report {report_file} on sheet {report_sheet}.")
         return None
@@ -235,13 +1025,73 @@ def main(input_file, sheet_name, division_column, type_column, product_kind_colu
     # Шаг 4: Упорядочивание основного DataFrame в соответствии с упорядоченными типами
     df = reorder_dataframe(df, type_column, ordered_types)
 
-    # Шаг 5: Создание DataFrame для каждой уникальной категории в столбце "Деления"
-    dataframes = create_dataframes_by_division(df, division_column)
-    if dataframes is None:
+    # Шаг 5: Подсчет таблиц для каждой уникальной категории в столбце "Деления" за один проход
+    if division_column not in df.columns:
+        print(f"Column '{division_column}' not found in DataFrame")
+        print(f"Available columns: {df.columns.tolist()}")
         return None
 
     # Шаг 6: Обработка и возврат обработанных DataFrame
-    processed_dataframes = process_dataframes(dataframes, type_column, product_kind_column, result_column)
+    if incremental and cache_dir:
+        processed_dataframes = process_dataframe_incremental(df, division_column, type_column, product_kind_column,
+                                                             result_column, cache_dir)
+    elif cache_dir:
+        processed_dataframes = process_dataframe_cached(df, division_column, type_column, product_kind_column,
+                                                        result_column, cache_dir)
+    else:
+        processed_dataframes = process_dataframe(df, division_column, type_column, product_kind_column,
+                                                 result_column)
     if processed_dataframes is not None:
         print("Dataframes processed and ready for use in another module.")
     return processed_dataframes
+
+
+def main_in_chunks(input_file, sheet_name, division_column, type_column, product_kind_column, result_column,
+                   report_file, report_sheet, header_row=0, chunk_rows=100_000, product_kind_mapping=None,
+                   report_workbook=None, cache_dir=None, divisions=None):
+    """
+    Потоковый вариант main: база читается частями, подсчеты накапливаются в CountAccumulator.
+    """
+    if not os.path.isfile(input_file):
+        print(f"Error: File {input_file} does not exist.")
+        return None
+
+    # Шаг 1: Накопление подсчетов по частям основной базы
+    accumulator = CountAccumulator(division_column, type_column, product_kind_column, result_column,
+                                   product_kind_mapping)
+    try:
+        with instrumentation.stage('load_and_count_chunks', chunk_rows=chunk_rows) as stage:
+            for chunk in iter_input_chunks(input_file, sheet_name, header_row, chunk_rows, divisions):
+                if division_column not in chunk.columns:
+                    print(f"Column '{division_column}' not found in DataFrame")
+                    print(f"Available columns: {chunk.columns.tolist()}")
+                    return None
+                accumulator.update(chunk)
+            stage['rows'] = accumulator.rows
+    except Exception as e:
+        print(f"Error loading file {input_file} on sheet {sheet_name}: {e}")
+        return None
+    print(f"Aggregated {accumulator.rows} rows from {input_file}")
+
+    # Шаг 2: Получение списка уникальных значений "ТИП кредита"
+    unique_types = accumulator.unique_types()
+    print(f"Unique types in the base data: {unique_types}")
+
+    # Шаг 3: Получение упорядоченного списка "ТИП кредита" из отчета
+    ordered_types = find_ordered_types_in_report(report_file, report_sheet, unique_types, report_workbook)
+    if not ordered_types:
+        print(f"No ordered types found in report {report_file} on sheet {report_sheet}.")
+        return None
+
+    print(f"Ordered types from the report: {ordered_types}")
+
+    # Шаг 4: Сборка таблиц из накопленных подсчетов
+    try:
+        with instrumentation.stage('aggregate', rows=accumulator.rows) as stage:
+            processed_dataframes = accumulator.result(ordered_types)
+            stage['cells'] = sum(table.size for table in processed_dataframes.values())
+    except Exception as e:
+        print(f"Error processing dataframes: {e}")
+        return None
+    print("Dataframes processed and ready for use in another module.")
+    return processed_dataframes
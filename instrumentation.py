@@ -0,0 +1,122 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Включается флагом enable() или переменной окружения REPORT_INSTRUMENTATION=1
+enabled = os.environ.get('REPORT_INSTRUMENTATION') == '1'
+trace_memory = os.environ.get('REPORT_INSTRUMENTATION_TRACEMALLOC') == '1'
+
+stages = []
+counters = {}
+
+# Порядок основных столбцов сводной таблицы
+summary_columns = ['stage', 'wall_s', 'cpu_s', 'peak_rss_mb', 'tracemalloc_peak_mb', 'rows', 'cells']
+
+
+def enable(memory=False):
+    """
+    Включает сбор показателей по этапам; memory=True дополнительно включает tracemalloc
+    (точный пик памяти по этапу ценой заметного замедления).
+    """
+    global enabled, trace_memory
+    enabled = True
+    trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled, trace_memory
+    enabled = False
+    if trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    trace_memory = False
+
+
+def reset():
+    """
+    Очищает собранные этапы и счетчики.
+    """
+    stages.clear()
+    counters.clear()
+
+
+def peak_rss_mb():
+    """
+    Пиковый размер резидентной памяти процесса в МБ (None, если недоступно на платформе).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает КБ, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Замеряет этап: время, процессорное время, пик памяти. В возвращаемый словарь можно
+    дописать количество обработанных строк и ячеек (rows, cells).
+    """
+    record = {'stage': name, **fields}
+    if not enabled:
+        yield record
+        return
+
+    if trace_memory and tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+        if trace_memory and tracemalloc.is_tracing():
+            record['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        stages.append(record)
+
+
+def count(name, amount=1):
+    """
+    Увеличивает счетчик (например, workbook_loads, workbook_saves, cells_written).
+    """
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def report():
+    """
+    Возвращает собранные показатели в виде словаря, пригодного для JSON.
+    """
+    return {'stages': list(stages), 'counters': dict(counters), 'peak_rss_mb': peak_rss_mb()}
+
+
+def write_json(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report(), f, ensure_ascii=False, indent=2)
+
+
+def summary_table():
+    """
+    Возвращает текстовую таблицу по этапам и счетчикам.
+    """
+    if not stages and not counters:
+        return "No instrumentation data collected."
+    lines = []
+    if stages:
+        import pandas as pd
+
+        table = pd.DataFrame(stages, dtype=object)
+        leading = [col for col in summary_columns if col in table.columns]
+        table = table[leading + [col for col in table.columns if col not in leading]]
+        lines.append(table.fillna('').to_string(index=False))
+    if counters:
+        lines.append(', '.join(f"{name}={value}" for name, value in sorted(counters.items())))
+    return '\n\n'.join(lines)
@@ -1,14 +1,18 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import openpyxl
-import pandas as pd
 import shutil
 import re
-import win32com.client as win32
 from openpyxl import load_workbook
 from openpyxl.styles import Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
-from data_processing import main, apply_structure_and_sorting
+import instrumentation
+from cache import default_cache_dir
+from column_insertion import insert_columns
+from data_processing import main, apply_structure_and_sorting, compare_processed_dataframes, load_excel
+from report_constants import division_column, main_merged_cells, product_kind_column, result_column, type_column
+from report_session import ReportSession
 from testreport import create_od_percent_table
 
 def copy_excel_file(source_file, destination_file):
@@ -24,7 +28,10 @@ def copy_excel_file(source_file, destination_file):
 def create_columns_with_pywin32(excel_file, sheet_name, start_col, num_columns):
     """
     Создает столбцы в указанном листе Excel файла с использованием pywin32 и метода Columns.Insert.
+    Требует установленного Excel (только Windows).
     """
+    import win32com.client as win32
+
     xlApp = win32.Dispatch('Excel.Application')
     xlApp.Visible = False
     wb = xlApp.Workbooks.Open(excel_file)
@@ -41,38 +48,117 @@ def create_columns_with_pywin32(excel_file, sheet_name, start_col, num_columns):
     wb.Close()
     xlApp.Quit()
 
-def create_columns_and_insert_headers_and_data(excel_file, address, df, total_added_columns, initial_headers, is_overall_summary=False):
+def create_columns_and_insert_headers_and_data(excel_file, address, df, total_added_columns, initial_headers, is_overall_summary=False, use_excel_com=False):
     """
     Создает столбцы в указанном листе Excel файла с использованием адреса, вставляет заголовки и данные.
+    Столбцы вставляются средствами openpyxl; use_excel_com=True вставляет их через Excel (pywin32).
     """
     sheet_name, start_row, start_col = address  # Игнорируем строку
-    num_columns = len(initial_headers)  # Используем начальный порядок столбцов
-    start_col += total_added_columns
 
-    # Создание столбцов с использованием pywin32
-    create_columns_with_pywin32(excel_file, sheet_name, start_col, num_columns)
+    if use_excel_com:
+        # Создание столбцов с использованием pywin32
+        create_columns_with_pywin32(excel_file, sheet_name, start_col + total_added_columns, len(initial_headers))
+        wb = load_workbook(excel_file)
+        insert_headers_and_data(wb[sheet_name], address, df, total_added_columns, initial_headers, is_overall_summary, insert=False)
+    else:
+        wb = load_workbook(excel_file)
+        insert_headers_and_data(wb[sheet_name], address, df, total_added_columns, initial_headers, is_overall_summary)
+    wb.save(excel_file)
+    wb.close()
+
+# Стили блока создаются один раз на модуль, а не при каждой вставке
+thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+fill_blue = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
+fill_red = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
+red_headers = ["Не дозвон", "Бросил трубку", "Другой номер", "Не знаком с клиентом", "Дело в суде", "Клиент умер", "Отказывается от оплаты", "Отказывается от разговора"]
 
-    wb = load_workbook(excel_file)
-    ws = wb[sheet_name]
 
-    # Вставка заголовков в порядке initial_headers
-    header_row = start_row + 1 if is_overall_summary else start_row
-    red_headers = ["Не дозвон", "Бросил трубку", "Другой номер", "Не знаком с клиентом", "Дело в суде", "Клиент умер", "Отказывается от оплаты", "Отказывается от разговора"]
+class BlockStyles:
+    """
+    Оформление ячеек блока по идентификатору стиля ('header', 'header_red', 'merged', 'data').
+    Используются общие объекты рамки и заливок модуля и публичные свойства ячейки: одинаковые рамки
+    и заливки книга хранит в своих таблицах стилей один раз.
+    """
+
+    assignments = {
+        'header': (('border', thin_border),),
+        'header_red': (('border', thin_border), ('fill', fill_red)),
+        'merged': (('fill', fill_blue), ('border', thin_border)),
+        'data': (('number_format', 'General'),),  # Общий формат
+    }
+
+    def apply(self, cell, style_id):
+        for attr, value in self.assignments[style_id]:
+            setattr(cell, attr, value)
+
+
+def compile_header_plan(initial_headers, header_row, start_col):
+    """
+    План записи заголовков блока: кортежи (строка, столбец, значение, идентификатор стиля).
+    """
+    return [(header_row, start_col + i, header, 'header_red' if header in red_headers else 'header')
+            for i, header in enumerate(initial_headers)]
 
-    for i, header in enumerate(initial_headers):
-        cell = ws.cell(row=header_row, column=start_col + i)
-        cell.value = header
 
-    # Форматирование границ и закрашивание заголовков
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    fill_blue = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
-    fill_red = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
+def compile_data_plan(df, initial_headers, merge_row, start_col, find_row):
+    """
+    План оформления объединенной строки и записи данных блока. find_row(значение) возвращает
+    номер строки отчета с подписью или None. Значение None в плане означает изменение только стиля.
+    """
+    plan = [(merge_row, col, None, 'merged') for col in range(start_col, start_col + len(initial_headers))]
+    columns = [df[header].to_numpy() if header in df.columns else None for header in initial_headers]
+    for idx, index_value in enumerate(df.index):
+        if isinstance(index_value, str) or isinstance(index_value, float):
+            row_number = find_row(index_value)
+            if row_number:
+                for col_idx, values in enumerate(columns):
+                    value = values[idx] if values is not None else None
+                    if value is not None:
+                        plan.append((row_number, start_col + col_idx, value, 'data'))
+    return plan
 
-    for i in range(num_columns):
-        cell = ws.cell(row=header_row, column=start_col + i)
-        cell.border = thin_border
-        if cell.value in red_headers:
-            cell.fill = fill_red
+
+def apply_plan(ws, plan, styles, cell_index=None):
+    """
+    Применяет план записи к листу за один проход; cell_index обновляется при записи значений.
+    """
+    written = 0
+    for row, col, value, style_id in plan:
+        if value is None:
+            cell = ws.cell(row=row, column=col)
+        elif cell_index is not None:
+            cell = cell_index.set(row, col, value)
+            written += 1
+        else:
+            cell = ws.cell(row=row, column=col)
+            cell.value = value
+            written += 1
+        styles.apply(cell, style_id)
+    instrumentation.count('cells_written', written)
+
+
+def insert_headers_and_data(ws, address, df, total_added_columns, initial_headers, is_overall_summary=False, insert=True, cell_index=None, styles=None):
+    """
+    Создает столбцы в уже открытом листе по адресу, вставляет заголовки и данные без сохранения книги.
+    insert=False - столбцы уже созданы (например, через Excel).
+    cell_index - индекс значений листа (CellIndex) для поиска строк; обновляется при вставке и записи.
+    styles - общий BlockStyles (создается при отсутствии).
+    """
+    sheet_name, start_row, start_col = address  # Игнорируем строку
+    num_columns = len(initial_headers)  # Используем начальный порядок столбцов
+    start_col += total_added_columns
+    if styles is None:
+        styles = BlockStyles()
+
+    if insert:
+        insert_columns(ws, start_col, num_columns)
+        instrumentation.count('columns_inserted', num_columns)
+        if cell_index is not None:
+            cell_index.shift_columns(start_col, num_columns)
+
+    # Вставка заголовков в порядке initial_headers с границами и закрашиванием
+    header_row = start_row + 1 if is_overall_summary else start_row
+    apply_plan(ws, compile_header_plan(initial_headers, header_row, start_col), styles, cell_index)
 
     # Объединение ячеек на одну строку выше заголовков
     merge_row = header_row - 1
@@ -80,52 +166,128 @@ def create_columns_and_insert_headers_and_data(excel_file, address, df, total_ad
     end_merge_col = get_column_letter(start_col + num_columns - 1)
     ws.merge_cells(f"{start_merge_col}{merge_row}:{end_merge_col}{merge_row}")
 
-    # Закрашивание объединенных ячеек и добавление границ
-    for col in range(start_col, start_col + num_columns):
-        cell = ws.cell(row=merge_row, column=col)
-        cell.fill = fill_blue
-        cell.border = thin_border
+    def find_row(value):
+        if cell_index is not None:
+            position = cell_index.first(value)
+            return position[0] if position else None
+        cell_address = find_row_in_report(ws, value)
+        return openpyxl.utils.cell.coordinate_to_tuple(cell_address)[0] if cell_address else None
 
-    # Вставка данных
-    for idx, index_value in enumerate(df.index):
-        if isinstance(index_value, str) or isinstance(index_value, float):
-            cell_address = find_row_in_report(ws, index_value)
-            if cell_address:
-                col_letter, row_number = re.findall(r'([A-Z]+)([0-9]+)', cell_address)[0]
-                row_number = int(row_number)
-                for col_idx, header in enumerate(initial_headers):
-                    value = df.at[index_value, header] if header in df.columns else None
-                    if value is not None:
-                        cell = ws.cell(row=row_number, column=start_col + col_idx)
-                        cell.value = value
-                        cell.number_format = 'General'  # Устанавливаем общий формат
-    wb.save(excel_file)
-    wb.close()
+    # Закрашивание объединенных ячеек и вставка данных
+    apply_plan(ws, compile_data_plan(df, initial_headers, merge_row, start_col, find_row), styles, cell_index)
 
-def find_row_in_report(ws, search_value):
+def find_row_in_report(ws, search_value, cell_index=None):
     """
     Находит строку в листе Excel файла, содержащую указанное значение и возвращает адрес ячейки.
+    При переданном cell_index поиск выполняется по индексу без обхода листа.
     """
+    if cell_index is not None:
+        return cell_index.coordinate(search_value)
     for row_cells in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
         for cell in row_cells:
             if cell.value == search_value:
                 return cell.coordinate
     return None
 
-def main_script(input_file, sheet_name, report_file, report_sheet, output_file):
+def write_blocks(session, processed_dataframes, initial_headers_dict, addresses_df, report_sheet, delta_dataframes=None):
+    """
+    Вставляет таблицы категорий в открытый шаблон по адресам из create_od_percent_table без сохранения книги.
+    delta_dataframes - таблицы изменений из compare_processed_dataframes; блок изменений категории
+    вставляется сразу справа от ее блока.
+    """
+    # Преобразование адресов вставки в формат словаря
+    addresses = {}
+    for index, row in addresses_df.iterrows():
+        category = row['Category']
+        address = row['Address']
+        sheet_name = report_sheet  # Все адреса на одном листе
+        start_col, start_row = re.findall(r'([A-Z]+)([0-9]+)', address)[0]
+        start_col = openpyxl.utils.column_index_from_string(start_col)
+        start_row = int(start_row)
+        addresses[category] = (sheet_name, start_row, start_col)
+
+    total_added_columns = 0
+    styles = BlockStyles()
+
+    with instrumentation.stage('write_blocks'):
+        for category, address in addresses.items():
+            if category in processed_dataframes:
+                df = processed_dataframes[category]
+                initial_headers = initial_headers_dict[category]
+                is_overall_summary = category == 'Общий итог'
+                insert_headers_and_data(session.sheet, address, df, total_added_columns, initial_headers, is_overall_summary, cell_index=session.cell_index, styles=styles)
+                total_added_columns += len(initial_headers)  # Учитываем все добавленные столбцы
+                if delta_dataframes and category in delta_dataframes:
+                    delta_df = delta_dataframes[category]
+                    delta_headers = delta_df.columns.tolist()
+                    insert_headers_and_data(session.sheet, address, delta_df, total_added_columns, delta_headers, is_overall_summary, cell_index=session.cell_index, styles=styles)
+                    title_row = address[1] if is_overall_summary else address[1] - 1
+                    session.cell_index.set(title_row, address[2] + total_added_columns, f"Изменение: {category}")
+                    total_added_columns += len(delta_headers)
+
+def main_script(input_file, sheet_name, report_file, report_sheet, output_file, cache_dir=None, input_df=None,
+                incremental=False, divisions=None, concurrent=False, session=None, addresses_df=None,
+                product_kind_mapping=None, previous_dataframes=None):
+    """
+    Строит отчет: подсчитывает таблицы по основной базе и вставляет их в копию шаблона.
+    cache_dir - каталог кэша снимков базы, таблиц и разметки шаблона (по умолчанию REPORT_CACHE_DIR).
+    input_df - уже загруженная основная база (например, общая для пакетной обработки).
+    incremental - пересчитывать только деления, изменившиеся с прошлого запуска (вместе с cache_dir).
+    divisions - строить отчет только по этим делениям.
+    concurrent - загружать основную базу в отдельном процессе, пока открывается и размечается шаблон.
+    session, addresses_df - уже открытый шаблон (ReportSession) и его адреса вставки, если они известны заранее;
+    переданная сессия закрывается по завершении, в том числе при ошибке.
+    product_kind_mapping - словарь вида продукта и списка типов кредита (по умолчанию product_kinds).
+    previous_dataframes - таблицы process_dataframes за предыдущую дату; рядом с блоками вставляются изменения.
+    Возвращает True, если отчет сохранен.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir
     try:
-        division_column = 'Деления'
-        type_column = 'ТИП кредита'
-        product_kind_column = 'Вид продукта'
-        result_column = 'Результат'
         header_row = 0
 
+        # Основная база загружается в отдельном процессе параллельно с разбором шаблона;
+        # загруженная здесь база больше нигде не используется, поэтому main работает с ней без копии,
+        # а фильтр делений уже применен при загрузке и повторно не выполняется
+        owns_input = input_df is None
+        main_divisions = divisions
+        pool = None
+        base_future = None
+        if concurrent and input_df is None:
+            pool = ProcessPoolExecutor(max_workers=1)
+            base_future = pool.submit(load_excel, input_file, sheet_name, header_row, product_kind_mapping, cache_dir,
+                                      divisions=divisions)
+        try:
+            with instrumentation.stage('template_analysis', concurrent=concurrent):
+                # Шаблон отчета открывается один раз на весь этап записи
+                if session is None:
+                    session = ReportSession(report_file, report_sheet)
+
+                # Получение данных из модуля testreport (Y)
+                if addresses_df is None:
+                    addresses_df = create_od_percent_table(report_file, report_sheet, main_merged_cells, cache_dir=cache_dir, session=session)
+
+            if addresses_df.empty:
+                print("No data was processed from testreport module.")
+                return False
+
+            if base_future is not None:
+                with instrumentation.stage('wait_for_base'):
+                    input_df = base_future.result()
+                if input_df is None:
+                    print(f"Could not load {input_file}.")
+                    return False
+                main_divisions = None
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
         # Получение обработанных данных (X)
-        processed_dataframes = main(input_file, sheet_name, division_column, type_column, product_kind_column, result_column, report_file, report_sheet, header_row)
+        processed_dataframes = main(input_file, sheet_name, division_column, type_column, product_kind_column, result_column, report_file, report_sheet, header_row, product_kind_mapping, cache_dir=cache_dir, report_workbook=session.workbook, input_df=input_df, incremental=incremental, divisions=main_divisions, copy_input=not owns_input)
 
         if not processed_dataframes:
             print("No data was processed from data_processing module.")
-            return
+            return False
 
         # Сохранение первоначального порядка заголовков для каждого DataFrame
         initial_headers_dict = {df_name: df.columns.tolist() for df_name, df in processed_dataframes.items()}
@@ -135,42 +297,26 @@ def main_script(input_file, sheet_name, report_file, report_sheet, output_file):
             if df.columns[0] == "":
                 df.columns = [""] + df.columns[1:].tolist()
 
-        # Получение данных из модуля testreport (Y)
-        main_merged_cells = ['30-', '30+', '60+', '90+', '180+', '365+']
-        addresses_df = create_od_percent_table(report_file, report_sheet, main_merged_cells)
-
-        if addresses_df.empty:
-            print("No data was processed from testreport module.")
-            return
-
-        # Преобразование адресов вставки в формат словаря
-        addresses = {}
-        for index, row in addresses_df.iterrows():
-            category = row['Category']
-            address = row['Address']
-            sheet_name = report_sheet  # Все адреса на одном листе
-            start_col, start_row = re.findall(r'([A-Z]+)([0-9]+)', address)[0]
-            start_col = openpyxl.utils.column_index_from_string(start_col)
-            start_row = int(start_row)
-            addresses[category] = (sheet_name, start_row, start_col)
-
-        # Копирование исходного файла в новый файл
-        copy_excel_file(report_file, output_file)
-
-        total_added_columns = 0
+        # Изменения к предыдущей дате считаются по уже готовым таблицам, без повторного подсчета
+        delta_dataframes = None
+        if previous_dataframes:
+            delta_dataframes = compare_processed_dataframes(previous_dataframes, processed_dataframes)
 
         # Создание столбцов, вставка заголовков и данных для каждой категории
-        for category, address in addresses.items():
-            if category in processed_dataframes:
-                df = processed_dataframes[category]
-                initial_headers = initial_headers_dict[category]
-                is_overall_summary = category == 'Общий итог'
-                create_columns_and_insert_headers_and_data(output_file, address, df, total_added_columns, initial_headers, is_overall_summary)
-                total_added_columns += len(initial_headers)  # Учитываем все добавленные столбцы
+        write_blocks(session, processed_dataframes, initial_headers_dict, addresses_df, report_sheet, delta_dataframes)
+
+        # Сохранение всех вставок в новый файл одним вызовом
+        session.save(output_file)
 
         print("Процесс завершен успешно.")
+        return True
     except Exception as e:
         print(f"Произошла ошибка: {e}")
+        return False
+    finally:
+        # Книга шаблона закрывается и при ошибке, чтобы постоянно работающий обработчик не удерживал ее
+        if session is not None:
+            session.close()
 
 if __name__ == "__main__":
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -188,3 +334,9 @@ if __name__ == "__main__":
 
     # Основной скрипт для обработки данных и вставки их в скопированный файл
     main_script(input_file, sheet_name, report_file, report_sheet, output_file)
+
+    # Показатели по этапам (REPORT_INSTRUMENTATION=1), при необходимости также в JSON
+    if instrumentation.enabled:
+        print(instrumentation.summary_table())
+        if os.environ.get('REPORT_INSTRUMENTATION_JSON'):
+            instrumentation.write_json(os.environ['REPORT_INSTRUMENTATION_JSON'])
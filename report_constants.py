@@ -0,0 +1,14 @@
+# Общие настройки отчета для main, cli, batch и worker; модуль не импортирует pandas и openpyxl
+
+# Столбцы основной базы
+division_column = 'Деления'
+type_column = 'ТИП кредита'
+product_kind_column = 'Вид продукта'
+result_column = 'Результат'
+
+# Листы основной базы и отчета по умолчанию
+default_sheet_name = 'Лист1'
+default_report_sheet = 'Сводная погашения NEW'
+
+# Блоки отчета, в которые вставляются таблицы делений
+main_merged_cells = ['30-', '30+', '60+', '90+', '180+', '365+']
@@ -0,0 +1,73 @@
+import hashlib
+import io
+
+from openpyxl import load_workbook
+
+import instrumentation
+from cache import file_fingerprint
+from testreport import CellIndex
+
+
+class ReportSession:
+    """
+    Шаблон отчета, открытый один раз на весь этап записи: книга используется для поиска порядка типов,
+    адресов вставки и всех вставок, а результат сохраняется одним вызовом save.
+    content - содержимое файла шаблона, уже прочитанное в память (тогда файл с диска не читается).
+    """
+
+    def __init__(self, report_file, report_sheet, content=None):
+        self.report_file = report_file
+        self.report_sheet = report_sheet
+        with instrumentation.stage('load_template') as stage:
+            self.workbook = load_workbook(io.BytesIO(content) if content is not None else report_file)
+            stage['cells'] = sum(len(ws._cells) for ws in self.workbook.worksheets)
+        instrumentation.count('workbook_loads')
+        self._cell_index = None
+        self._content = content
+        # Отпечаток файла снимается до чтения, чтобы он соответствовал загруженному содержимому
+        self._fingerprint = file_fingerprint(report_file) if content is None else None
+        print(f"Report template {report_file} loaded")
+
+    @property
+    def sheet(self):
+        return self.workbook[self.report_sheet]
+
+    @property
+    def cell_index(self):
+        """
+        Индекс значений листа отчета, строится при первом обращении.
+        """
+        if self._cell_index is None:
+            with instrumentation.stage('build_cell_index') as stage:
+                self._cell_index = CellIndex(self.sheet)
+                stage['cells'] = len(self._cell_index.values)
+        return self._cell_index
+
+    @property
+    def fingerprint(self):
+        """
+        Отпечаток шаблона для ключей кэша: хэш содержимого, если оно передано, иначе путь, размер и время
+        изменения файла. Вычисляется один раз на сессию и не требует обхода листа.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha1(self._content).hexdigest()
+        return self._fingerprint
+
+    def save(self, output_file):
+        """
+        Сохраняет книгу со всеми вставками в выходной файл.
+        """
+        with instrumentation.stage('save_report') as stage:
+            self.workbook.save(output_file)
+            stage['cells'] = sum(len(ws._cells) for ws in self.workbook.worksheets)
+        instrumentation.count('workbook_saves')
+        print(f"Report saved to {output_file}")
+
+    def close(self):
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
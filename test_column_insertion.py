@@ -0,0 +1,76 @@
+import openpyxl
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles import PatternFill
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.worksheet.hyperlink import Hyperlink
+
+from column_insertion import insert_columns
+
+
+def make_workbook():
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Сводная'
+    for row in range(1, 4):
+        for col in range(1, 6):
+            sheet.cell(row, col, row * 10 + col)
+    sheet.merge_cells('B1:C1')
+    sheet.merge_cells('D2:E2')
+    sheet['A3'] = '=C2*2'
+    sheet.column_dimensions['B'].width = 15
+    sheet.column_dimensions['D'].width = 25
+    sheet.conditional_formatting.add('C1:D3', FormulaRule(formula=['C1>20'], fill=PatternFill(bgColor='FF0000')))
+    sheet['D3'].hyperlink = 'https://example.com'
+    sheet.print_area = 'A1:E3'
+    workbook.defined_names['Block'] = DefinedName('Block', attr_text="'Сводная'!$C$1:$D$3")
+
+    other = workbook.create_sheet('Итоги')
+    other['A1'] = "=SUM('Сводная'!B1:D1)"
+    other['A2'] = "='Сводная'!A1"
+    other['A3'] = '=D1'
+    other['A4'].hyperlink = Hyperlink(ref='A4', location="'Сводная'!D1")
+    return workbook
+
+
+def check_shifted(workbook):
+    sheet = workbook['Сводная']
+    other = workbook['Итоги']
+
+    # Ячейки справа от вставки сдвигаются, новые столбцы пусты
+    assert [sheet.cell(3, col).value for col in range(2, 8)] == [32, None, None, 33, 34, 35]
+
+    # Диапазон через вставку расширяется, диапазон правее - сдвигается
+    assert sorted(str(merged) for merged in sheet.merged_cells.ranges) == ['B1:E1', 'F2:G2']
+
+    # Формулы листа и других листов ссылаются на те же данные
+    assert sheet['A3'].value == '=E2*2'
+    assert other['A1'].value == "=SUM('Сводная'!B1:F1)"
+    assert other['A2'].value == "='Сводная'!A1"
+    assert other['A3'].value == '=D1'
+
+    # Ширины: столбец D переехал в F, новые столбцы получили ширину столбца слева
+    assert sheet.column_dimensions['B'].width == 15
+    assert sheet.column_dimensions['C'].width == 15
+    assert sheet.column_dimensions['F'].width == 25
+
+    ranges = [(str(cf.sqref), [rule.formula for rule in cf.rules]) for cf in sheet.conditional_formatting]
+    assert ranges == [('E1:F3', [['E1>20']])]
+
+    assert sheet['F3'].hyperlink.target == 'https://example.com'
+    assert other['A4'].hyperlink.location == "'Сводная'!F1"
+    assert workbook.defined_names['Block'].attr_text == "'Сводная'!$E$1:$F$3"
+    assert sheet.print_area == "'Сводная'!$A$1:$G$3"
+
+
+def test_insert_columns_shifts_dependent_structures():
+    workbook = make_workbook()
+    insert_columns(workbook['Сводная'], 3, 2)
+    check_shifted(workbook)
+
+
+def test_insert_columns_survives_save_and_reload(tmp_path):
+    workbook = make_workbook()
+    insert_columns(workbook['Сводная'], 3, 2)
+    path = tmp_path / 'inserted.xlsx'
+    workbook.save(path)
+    check_shifted(openpyxl.load_workbook(path))
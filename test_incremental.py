@@ -0,0 +1,37 @@
+import pandas as pd
+
+from data_processing import classify_product_kinds, process_dataframe, process_dataframe_incremental, \
+    reorder_dataframe
+
+columns = ('Деления', 'ТИП кредита', 'Вид продукта', 'Результат')
+ordered_types = ['ипотека', 'cashloan', 'автокредиты', 'Овердрафт']
+
+
+def prepare(rows):
+    df = pd.DataFrame(rows, columns=['Деления', 'ТИП кредита', 'Результат'])
+    df['Вид продукта'] = classify_product_kinds(df['ТИП кредита'])
+    return reorder_dataframe(df, 'ТИП кредита', ordered_types)
+
+
+def assert_same_tables(expected, actual):
+    assert list(expected) == list(actual)
+    for name in expected:
+        pd.testing.assert_frame_equal(expected[name].astype(float), actual[name].astype(float), check_names=False)
+
+
+def test_new_division_with_new_result_matches_full_recompute(tmp_path):
+    rows = [
+        ('30-', 'ипотека', 'Дал обещание'),
+        ('30-', 'cashloan', 'Не звонили'),
+        ('30-', 'Неизвестный тип', 'Не звонили'),
+        ('30+', 'автокредиты', 'Дал обещание'),
+        ('30+', 'Овердрафт', 'Не дозвон'),
+    ]
+    first = prepare(rows)
+    assert_same_tables(process_dataframe(first, *columns),
+                       process_dataframe_incremental(first, *columns, str(tmp_path)))
+
+    # Новое маленькое деление без строки "Неопределенный" и с результатом, которого еще нет в сумме
+    second = prepare(rows + [('60+', 'ипотека', 'Дело в суде')])
+    assert_same_tables(process_dataframe(second, *columns),
+                       process_dataframe_incremental(second, *columns, str(tmp_path)))
@@ -0,0 +1,32 @@
+import openpyxl
+
+from data_processing import find_ordered_types_in_report
+
+types = ['ипотека', 'cashloan', 'автокредиты']
+
+
+def save_template(path, rows):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Сводная'
+    sheet['A1'] = 'Заголовок'
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def test_open_workbook_matches_file_scan(tmp_path):
+    path = tmp_path / 'template.xlsx'
+    save_template(path, [['cashloan', 1], ['ипотека', '=B2*2']])
+    workbook = openpyxl.load_workbook(path)
+    assert find_ordered_types_in_report(path, 'Сводная', types, workbook=workbook) == ['cashloan', 'ипотека']
+    assert find_ordered_types_in_report(path, 'Сводная', types) == ['cashloan', 'ипотека']
+
+
+def test_formula_cells_fall_back_to_cached_values(tmp_path):
+    path = tmp_path / 'template.xlsx'
+    save_template(path, [['="ипотека"'], ['cashloan']])
+    workbook = openpyxl.load_workbook(path)
+    # Текст формулы не сравнивается с типами: порядок берется по сохраненным значениям файла
+    expected = find_ordered_types_in_report(path, 'Сводная', types)
+    assert find_ordered_types_in_report(path, 'Сводная', types, workbook=workbook) == expected
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from data_processing import apply_structure_and_sorting, assign_product_kind, classify_product_kinds, \
+    count_unique_values, create_dataframes_by_division, process_dataframe, reorder_dataframe
+
+columns = ('Деления', 'ТИП кредита', 'Вид продукта', 'Результат')
+ordered_types = ['ипотека', 'cashloan', 'автокредиты', 'Овердрафт']
+
+rows = [
+    ('30-', 'ипотека', 'Дал обещание'),
+    ('30-', 'cashloan', 'Не звонили'),
+    ('30-', 'Неизвестный тип', 'Не звонили'),
+    ('30-', np.nan, 'Дал обещание'),
+    ('30-', 'ипотека', np.nan),
+    ('30+', 'автокредиты', 'Дал обещание'),
+    ('30+', 'Овердрафт', 'Не дозвон'),
+    ('30+', 'cashloan', 'Дело в суде'),
+    ('60+', 'ипотека', 'Клиент умер'),
+    ('60+', np.nan, 'Не дозвон'),
+    ('60+', 'Неизвестный тип', np.nan),
+]
+# Строка, где пусты и тип, и результат, не включена: исходный pivot_table по упорядоченному
+# категориальному типу падает на ней в pandas 3 (IndexError), и деление выпадает из исходного расчета
+
+
+def base_frame(with_result=True):
+    df = pd.DataFrame(rows, columns=['Деления', 'ТИП кредита', 'Результат'])
+    if not with_result:
+        df = df.drop(columns='Результат')
+    return df
+
+
+def baseline_tables(df):
+    """
+    Исходный расчет: отдельная сводная таблица на каждое деление и сумма таблиц для "Общего итога".
+    """
+    processed_dataframes = {}
+    for division, division_df in create_dataframes_by_division(df, 'Деления').items():
+        pivot_table = count_unique_values(division_df, 'ТИП кредита', 'Вид продукта', 'Результат')
+        if pivot_table is not None:
+            processed_dataframes[division] = apply_structure_and_sorting(pivot_table)
+    overall_summary = pd.DataFrame()
+    for table in processed_dataframes.values():
+        overall_summary = overall_summary.add(table.apply(pd.to_numeric, errors='coerce').fillna(0), fill_value=0)
+    if not overall_summary.empty:
+        processed_dataframes['Общий итог'] = apply_structure_and_sorting(overall_summary)
+    return processed_dataframes
+
+
+def assert_same_tables(expected, actual):
+    assert list(expected) == list(actual)
+    for name in expected:
+        pd.testing.assert_frame_equal(expected[name].astype(float), actual[name].astype(float), check_names=False)
+
+
+def test_ordered_types_match_baseline():
+    baseline_df = base_frame()
+    baseline_df['Вид продукта'] = baseline_df['ТИП кредита'].apply(assign_product_kind)
+    baseline_df = reorder_dataframe(baseline_df, 'ТИП кредита', ordered_types)
+
+    df = base_frame()
+    df['Вид продукта'] = classify_product_kinds(df['ТИП кредита'])
+    df = reorder_dataframe(df, 'ТИП кредита', ordered_types)
+
+    expected = baseline_tables(baseline_df)
+    assert_same_tables(expected, process_dataframe(df, *columns))
+
+
+def test_unordered_types_match_baseline():
+    baseline_df = base_frame()
+    baseline_df['Вид продукта'] = baseline_df['ТИП кредита'].apply(assign_product_kind)
+
+    df = base_frame()
+    df['Вид продукта'] = classify_product_kinds(df['ТИП кредита'])
+
+    assert_same_tables(baseline_tables(baseline_df), process_dataframe(df, *columns))
+
+
+def test_missing_result_column_matches_baseline():
+    baseline_df = base_frame(with_result=False)
+    baseline_df['Вид продукта'] = baseline_df['ТИП кредита'].apply(assign_product_kind)
+
+    df = base_frame(with_result=False)
+    df['Вид продукта'] = classify_product_kinds(df['ТИП кредита'])
+
+    assert_same_tables(baseline_tables(baseline_df), process_dataframe(df, *columns) or {})
@@ -1,8 +1,14 @@
+import bisect
 import openpyxl
-import pandas as pd
 import re
 import warnings
 
+import instrumentation
+from cache import cache_load, cache_store, file_fingerprint, make_cache_key
+
+# Заголовок столбца, справа от которого вставляются данные блока
+od_percent_header = '% ОД к просроченному портфелю'
+
 # Отключаем предупреждения
 warnings.filterwarnings("ignore", category=UserWarning, module='openpyxl')
 
@@ -18,7 +24,92 @@ def extract_date_from_filename(file_path):
     return None
 
 
-def find_address_for_value(workbook, sheet_name, search_value):
+class CellIndex:
+    """
+    Индекс значений листа: значение -> координаты ячеек в порядке обхода по строкам (как при поиске
+    сверху вниз и слева направо). Строится один раз; записи через set и вставка столбцов через
+    shift_columns поддерживают его в актуальном состоянии.
+    """
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.positions = {}
+        self.values = {}
+        for (row, col), cell in sheet._cells.items():
+            value = cell._value
+            if value is None or value != value:  # пустые ячейки и NaN не индексируются
+                continue
+            self.values[row, col] = value
+            self.positions.setdefault(value, []).append((row, col))
+        # Ячейки загруженного листа обычно уже идут по строкам; сортируются только нарушенные списки
+        for positions in self.positions.values():
+            if len(positions) > 1 and any(positions[i] > positions[i + 1] for i in range(len(positions) - 1)):
+                positions.sort()
+
+    def _add(self, row, col, value):
+        if value is None or value != value:  # пустые ячейки и NaN не индексируются
+            return
+        self.values[row, col] = value
+        positions = self.positions.setdefault(value, [])
+        if not positions or positions[-1] < (row, col):
+            positions.append((row, col))
+        else:
+            bisect.insort(positions, (row, col))
+
+    def _remove(self, row, col):
+        value = self.values.pop((row, col), None)
+        if value is not None:
+            positions = self.positions[value]
+            positions.remove((row, col))
+            if not positions:
+                del self.positions[value]
+
+    def first(self, value):
+        """
+        Возвращает (строка, столбец) первой ячейки со значением или None.
+        """
+        positions = self.positions.get(value)
+        return positions[0] if positions else None
+
+    def all(self, value):
+        """
+        Возвращает координаты всех ячеек со значением в порядке обхода по строкам.
+        """
+        return list(self.positions.get(value, ()))
+
+    def coordinate(self, value):
+        """
+        Возвращает адрес первой ячейки со значением (например, "B5") или None.
+        """
+        position = self.first(value)
+        if position is None:
+            return None
+        return f"{openpyxl.utils.get_column_letter(position[1])}{position[0]}"
+
+    def set(self, row, col, value):
+        """
+        Записывает значение в ячейку листа и обновляет индекс.
+        """
+        cell = self.sheet.cell(row=row, column=col)
+        cell.value = value
+        self._remove(row, col)
+        self._add(row, col, value)
+        return cell
+
+    def shift_columns(self, idx, amount):
+        """
+        Сдвигает координаты после вставки amount столбцов перед столбцом idx.
+        Порядок обхода по строкам при этом не меняется.
+        """
+        for value, positions in self.positions.items():
+            self.positions[value] = [(row, col + amount if col >= idx else col) for row, col in positions]
+        self.values = {(row, col + amount if col >= idx else col): value for (row, col), value in self.values.items()}
+
+
+def find_address_for_value(workbook, sheet_name, search_value, cell_index=None):
+    if cell_index is not None:
+        return cell_index.coordinate(search_value)
+
     try:
         sheet = workbook[sheet_name]
     except KeyError:
@@ -34,47 +125,70 @@ def find_address_for_value(workbook, sheet_name, search_value):
     return None
 
 
-def find_od_percent_address(workbook, sheet_name, main_merged_cells, target_header):
+def find_od_percent_address(workbook, sheet_name, main_merged_cells, target_header, cell_index=None):
+    """
+    Находит адреса вставки для блоков main_merged_cells: под объединенным заголовком блока ищется
+    target_header, под ним - "% ОД к просроченному портфелю"; адрес - следующий столбец.
+    Все поиски выполняются по индексу значений листа (CellIndex), построенному за один проход.
+    """
     try:
         sheet = workbook[sheet_name]
     except KeyError:
         print(f'Лист "{sheet_name}" не найден в файле.')
         return []
 
-    results = []
+    if cell_index is None:
+        cell_index = CellIndex(sheet)
 
-    def increment_column(column, increment=1):
-        # Преобразует букву колонки в следующую
-        col_num = openpyxl.utils.column_index_from_string(column) + increment
-        return openpyxl.utils.get_column_letter(col_num)
+    header_positions = cell_index.all(target_header)
+    od_positions = cell_index.all(od_percent_header)
+    results = []
 
     for merged_cell in sheet.merged_cells.ranges:
-        cell_value = sheet.cell(merged_cell.min_row, merged_cell.min_col).value
-        if cell_value in main_merged_cells:
-            for row in range(merged_cell.max_row + 1, sheet.max_row + 1):
-                for col in range(merged_cell.min_col, merged_cell.max_col + 1):
-                    cell = sheet.cell(row=row, column=col)
-                    if cell.value == target_header:
-                        for sub_row in range(cell.row + 1, sheet.max_row + 1):
-                            for sub_col in range(cell.column,
-                                                 cell.column + (merged_cell.max_col - merged_cell.min_col) + 1):
-                                sub_cell = sheet.cell(row=sub_row, column=sub_col)
-                                if sub_cell.value == '% ОД к просроченному портфелю':
-                                    next_col = increment_column(openpyxl.utils.get_column_letter(sub_cell.column))
-                                    results.append({
-                                        'Category': cell_value,
-                                        'Address': f"{next_col}{sub_cell.row}"
-                                    })
-                                    break
-                            else:
-                                continue
-                            break
-                        break
+        cell_value = cell_index.values.get((merged_cell.min_row, merged_cell.min_col))
+        if cell_value not in main_merged_cells:
+            continue
+        width = merged_cell.max_col - merged_cell.min_col + 1
+        last_row = None
+        # Заголовок ищется ниже объединенной ячейки в ее столбцах, в каждой строке - первое совпадение
+        for row, col in header_positions:
+            if row <= merged_cell.max_row or not merged_cell.min_col <= col <= merged_cell.max_col or row == last_row:
+                continue
+            last_row = row
+            # Первая ячейка "% ОД" ниже заголовка в пределах ширины блока
+            for sub_row, sub_col in od_positions[bisect.bisect_right(od_positions, (row, float('inf'))):]:
+                if col <= sub_col < col + width:
+                    results.append({
+                        'Category': cell_value,
+                        'Address': f"{openpyxl.utils.get_column_letter(sub_col + 1)}{sub_row}"
+                    })
+                    break
 
     return results
 
 
-def create_od_percent_table(file_path, sheet_name, main_merged_cells):
+def create_od_percent_table(file_path, sheet_name, main_merged_cells, workbook=None, cell_index=None,
+                            cache_dir=None, session=None):
+    """
+    Возвращает таблицу категорий (Общий итог и блоки main_merged_cells) с адресами вставки.
+    cache_dir - каталог кэша разметки: результат хранится по отпечатку файла шаблона и дате отчета,
+    и при неизменном шаблоне поиск не выполняется.
+    session - открытый ReportSession: берутся его книга и отпечаток, а индекс значений строится только при промахе кэша.
+    """
+    od_percent_results = find_insert_addresses(file_path, sheet_name, main_merged_cells, workbook, cell_index,
+                                               cache_dir, session)
+    if od_percent_results is None:
+        import pandas as pd
+        return pd.DataFrame()
+    return od_percent_dataframe(od_percent_results, main_merged_cells)
+
+
+def find_insert_addresses(file_path, sheet_name, main_merged_cells, workbook=None, cell_index=None, cache_dir=None,
+                          session=None):
+    """
+    Возвращает список словарей Category/Address с адресами вставки в порядке поиска
+    или None, если дата в имени файла не найдена или файла нет. Работает без pandas.
+    """
     def increment_column(column, increment=1):
         # Преобразует букву колонки в следующую
         col_num = openpyxl.utils.column_index_from_string(column) + increment
@@ -83,19 +197,43 @@ def create_od_percent_table(file_path, sheet_name, main_merged_cells):
     date_from_filename = extract_date_from_filename(file_path)
     if not date_from_filename:
         print('Дата не найдена в имени файла.')
-        return pd.DataFrame()
+        return None
 
     target_header = f'Просроченная задолженность на {date_from_filename}'
     total_header = f'Кол-во просроченных анкет на {date_from_filename}'
 
-    try:
-        workbook = openpyxl.load_workbook(file_path)
-    except FileNotFoundError:
-        print(f'Файл "{file_path}" не найден.')
-        return pd.DataFrame()
+    # Если книга уже открыта (например, в ReportSession), повторно файл не читается
+    if session is not None:
+        workbook = session.workbook
+    if workbook is None:
+        try:
+            workbook = openpyxl.load_workbook(file_path)
+            instrumentation.count('workbook_loads')
+        except FileNotFoundError:
+            print(f'Файл "{file_path}" не найден.')
+            return None
+
+    # Ключ кэша не требует обхода листа: отпечаток файла (или содержимого сессии) и дата отчета
+    cache_key = None
+    if cache_dir and sheet_name in workbook.sheetnames:
+        template_key = session.fingerprint if session is not None else file_fingerprint(file_path)
+        cache_key = make_cache_key('layout', template_key, date_from_filename, sheet_name, list(main_merged_cells))
+        od_percent_results = cache_load(cache_dir, cache_key)
+        if od_percent_results is not None:
+            print(f'Разметка отчета "{file_path}" взята из кэша.')
+            return od_percent_results
+
+    with instrumentation.stage('template_layout') as stage:
+        if cell_index is None and session is not None:
+            cell_index = session.cell_index
+        if cell_index is None and sheet_name in workbook.sheetnames:
+            cell_index = CellIndex(workbook[sheet_name])
 
-    od_percent_results = find_od_percent_address(workbook, sheet_name, main_merged_cells, target_header)
-    total_address = find_address_for_value(workbook, sheet_name, total_header)
+        od_percent_results = find_od_percent_address(workbook, sheet_name, main_merged_cells, target_header,
+                                                     cell_index)
+        total_address = find_address_for_value(workbook, sheet_name, total_header, cell_index)
+        if cell_index is not None:
+            stage['cells'] = len(cell_index.values)
 
     if total_address:
         total_col = re.sub(r'[^A-Z]', '', total_address)
@@ -104,6 +242,18 @@ def create_od_percent_table(file_path, sheet_name, main_merged_cells):
         new_total_address = f"{new_total_col}{total_row}"
         od_percent_results.insert(0, {'Category': 'Общий итог', 'Address': new_total_address})
 
+    if cache_key is not None:
+        cache_store(cache_dir, cache_key, od_percent_results)
+
+    return od_percent_results
+
+
+def od_percent_dataframe(od_percent_results, main_merged_cells):
+    """
+    Собирает таблицу Category/Address, упорядоченную по main_merged_cells.
+    """
+    import pandas as pd
+
     # Удаление дубликатов из main_merged_cells
     unique_categories = pd.Series(['Общий итог'] + main_merged_cells).unique().tolist()
 
@@ -0,0 +1,175 @@
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from cache import default_cache_dir, file_fingerprint
+from data_processing import load_excel, product_kinds
+from main import main_script
+from report_constants import default_report_sheet, default_sheet_name, main_merged_cells
+from report_session import ReportSession
+from testreport import create_od_percent_table
+
+
+class ReportWorker:
+    """
+    Постоянно работающий обработчик заданий построения отчета. Между заданиями в памяти остаются
+    содержимое шаблонов и их адреса вставки, загруженные основные базы и словарь видов продукта;
+    число шаблонов и баз ограничено, давно не использованные вытесняются первыми.
+    Книга шаблона разбирается заново для каждого задания из содержимого в памяти: вставки меняют книгу,
+    а копировать книгу openpyxl целиком ненадежно.
+    """
+
+    def __init__(self, cache_dir=None, max_templates=8, max_inputs=2, product_kind_mapping=None,
+                 sheet_name=default_sheet_name, report_sheet=default_report_sheet):
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir
+        self.max_templates = max_templates
+        self.max_inputs = max_inputs
+        self.product_kind_mapping = product_kind_mapping if product_kind_mapping is not None else product_kinds
+        self.sheet_name = sheet_name
+        self.report_sheet = report_sheet
+        self.templates = OrderedDict()
+        self.inputs = OrderedDict()
+
+    @staticmethod
+    def _remember(entries, key, value, limit):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+    def template(self, report_file, report_sheet):
+        """
+        Возвращает (содержимое файла шаблона, адреса вставки); при изменении файла шаблон разбирается заново.
+        """
+        key = (file_fingerprint(report_file), report_sheet)
+        entry = self.templates.get(key)
+        if entry is not None:
+            self.templates.move_to_end(key)
+            return entry
+
+        with open(report_file, 'rb') as f:
+            content = f.read()
+        session = ReportSession(report_file, report_sheet, content)
+        try:
+            addresses_df = create_od_percent_table(report_file, report_sheet, main_merged_cells,
+                                                   cache_dir=self.cache_dir, session=session)
+        finally:
+            session.close()
+        entry = (content, addresses_df)
+        self._remember(self.templates, key, entry, self.max_templates)
+        return entry
+
+    def input_df(self, input_file, sheet_name):
+        """
+        Возвращает загруженную основную базу; при изменении файла база загружается заново.
+        """
+        key = (file_fingerprint(input_file), sheet_name)
+        df = self.inputs.get(key)
+        if df is not None:
+            self.inputs.move_to_end(key)
+            return df
+        df = load_excel(input_file, sheet_name, 0, self.product_kind_mapping, self.cache_dir)
+        if df is not None:
+            self._remember(self.inputs, key, df, self.max_inputs)
+        return df
+
+    def run_job(self, job):
+        """
+        Выполняет задание вида {"input_file", "report_file", "output_file"[, "sheet_name", "report_sheet",
+        "divisions"]} и возвращает словарь с результатом.
+        """
+        start = time.perf_counter()
+        sheet_name = job.get('sheet_name', self.sheet_name)
+        report_sheet = job.get('report_sheet', self.report_sheet)
+        try:
+            content, addresses_df = self.template(job['report_file'], report_sheet)
+            if addresses_df.empty:
+                ok, error = False, "No insert addresses found in the template"
+            else:
+                input_df = self.input_df(job['input_file'], sheet_name)
+                if input_df is None:
+                    ok, error = False, f"Could not load {job['input_file']}"
+                else:
+                    session = ReportSession(job['report_file'], report_sheet, content)
+                    ok = main_script(job['input_file'], sheet_name, job['report_file'], report_sheet,
+                                     job['output_file'], self.cache_dir, input_df=input_df,
+                                     divisions=job.get('divisions'), session=session, addresses_df=addresses_df,
+                                     product_kind_mapping=self.product_kind_mapping)
+                    error = None if ok else "main_script reported a failure, see the log"
+        except Exception as e:
+            ok, error = False, str(e)
+        return {**job, 'ok': bool(ok), 'error': error, 'seconds': round(time.perf_counter() - start, 3)}
+
+    @staticmethod
+    def requeue_stale(incoming, processing):
+        """
+        Возвращает в incoming задания, оставшиеся в processing после аварийного завершения обработчика.
+        Имя забранного задания начинается с PID обработчика; задания живых процессов не трогаются.
+        Возвращает число возвращенных заданий.
+        """
+        requeued = 0
+        for claimed_name in sorted(os.listdir(processing)):
+            pid, _, name = claimed_name.partition('-')
+            if not pid.isdigit() or not name.endswith('.json'):
+                continue
+            if int(pid) != os.getpid():
+                try:
+                    os.kill(int(pid), 0)
+                    continue  # обработчик еще работает
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue  # процесс существует, но принадлежит другому пользователю
+            try:
+                os.replace(os.path.join(processing, claimed_name), os.path.join(incoming, name))
+            except FileNotFoundError:
+                continue  # задание уже вернул другой обработчик
+            print(f"Job {name} was left unfinished by process {pid} and is queued again")
+            requeued += 1
+        return requeued
+
+    def serve_spool(self, spool_dir, poll_interval=1.0, once=False):
+        """
+        Обрабатывает задания из каталога spool_dir/incoming (по одному JSON файлу на задание, в порядке имен).
+        Задание забирается переименованием в spool_dir/processing под именем "<PID>-<имя>", результат
+        записывается в spool_dir/done. При запуске задания, брошенные завершившимися обработчиками,
+        возвращаются в incoming (обработчики должны работать на одной машине).
+        once=True - обработать уже имеющиеся задания и завершиться.
+        """
+        incoming, processing, done = (os.path.join(spool_dir, name) for name in ('incoming', 'processing', 'done'))
+        for path in (incoming, processing, done):
+            os.makedirs(path, exist_ok=True)
+        self.requeue_stale(incoming, processing)
+        print(f"Worker is watching {incoming}")
+
+        while True:
+            names = sorted(name for name in os.listdir(incoming) if name.endswith('.json'))
+            for name in names:
+                claimed = os.path.join(processing, f"{os.getpid()}-{name}")
+                try:
+                    os.replace(os.path.join(incoming, name), claimed)
+                except FileNotFoundError:
+                    continue  # задание уже забрал другой обработчик
+                try:
+                    with open(claimed, encoding='utf-8') as f:
+                        job = json.load(f)
+                    result = self.run_job(job)
+                except Exception as e:
+                    result = {'ok': False, 'error': f"Invalid job file: {e}"}
+                with open(os.path.join(done, name), 'w', encoding='utf-8') as f:
+                    json.dump(result, f, ensure_ascii=False, indent=2)
+                os.remove(claimed)
+                print(f"Job {name}: {'ok' if result['ok'] else result['error']}")
+            if once:
+                return
+            if not names:
+                time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    # Разбор параметров общий с cli.py: python worker.py ... равносильно python cli.py worker ...
+    from cli import main as cli_main
+
+    sys.exit(cli_main(['worker', *sys.argv[1:]]))